@@ -8,8 +8,8 @@ with open('suit/__init__.py', 'rb') as f:
     version = str(ast.literal_eval(_version_re.search(
         f.read().decode('utf-8')).group(1)))
 
-if sys.version_info < (3, 0):
-    raise NotImplementedError("Sorry, you need at least Python 3.x to use suit.")
+if sys.version_info < (3, 8):
+    raise NotImplementedError("Sorry, you need at least Python 3.8 to use suit.")
 
 try:
     from setuptools import setup
@@ -27,5 +27,6 @@ setup(
     author='ayurjev',
     author_email='',
     description='',
-    scripts=['bin/suitup.py']
+    scripts=['bin/suitup.py'],
+    python_requires='>=3.8'
 )
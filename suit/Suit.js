@@ -319,6 +319,45 @@ var SuitRunTime = function() {
         return result;
     };
 
+    /* Rendered fragments of <cache> tags: LRU by the order of the keys, limited by fragmentsLimit */
+    /* Keys are scoped by the template's name and the ordinal of the tag in it */
+    this.fragments = {};
+    this.fragmentsCount = 0;
+    this.fragmentsLimit = 256;
+
+    this.cache = function(scope, key, ttl, render) {
+        var id = scope + "#" + key, now = new Date().getTime(), entry = this.fragments[id];
+        if (entry !== undefined) {
+            delete this.fragments[id];
+            this.fragmentsCount--;
+            if (entry.expires === null || entry.expires > now) {
+                this.fragments[id] = entry;
+                this.fragmentsCount++;
+                return entry.value;
+            }
+        }
+        var value = render();
+        if (ttl !== null && ttl <= 0) { return value; }
+        this.fragments[id] = {"value": value, "expires": ttl === null ? null : now + ttl * 1000};
+        this.fragmentsCount++;
+        for (var oldest in this.fragments) {
+            if (this.fragmentsCount <= this.fragmentsLimit) { break; }
+            delete this.fragments[oldest];
+            this.fragmentsCount--;
+        }
+        return value;
+    };
+
+    this.each = function(itemGeneratorFunction, iterable) {
+        var result = "";
+        if (iterable instanceof Array) {
+            for (var i = 0; i < iterable.length; i++) { result += itemGeneratorFunction(i, iterable[i]); }
+        } else {
+            for (var key in iterable) { result += itemGeneratorFunction(key, iterable[key]); }
+        }
+        return result;
+    };
+
 };
 
 /**
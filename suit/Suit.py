@@ -35,15 +35,31 @@
 
 import re
 import os
+import sys
+import gc
 import json
+import types
+import marshal
+import asyncio
 import importlib
+import importlib.util
+from ast import literal_eval
+from functools import lru_cache
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+from keyword import iskeyword
+from time import perf_counter, monotonic
+from threading import Lock
+from collections import OrderedDict, ChainMap
 from html import escape, unescape
 from abc import ABCMeta, abstractmethod
 from datetime import datetime, date, time
 
 
 SuitTags = [
-    "var", "if", "list", "breakpoint", "expression", "condition", "true", "false", "iterationvar", "iterationkey"
+    "var", "if", "list", "breakpoint", "expression", "condition", "true", "false", "iterationvar", "iterationkey",
+    "flush", "environment", "cache"
 ]
 
 
@@ -296,13 +312,23 @@ class List(XmlTag):
         # parsing template
         self.iteration_template = TemplatePart(self.rename_iteration_variables(self.body))
 
-    def rename_iteration_variables(self, template):
+    def rename(self, names):
+        """
+        Renames the iteration variables in the compiled code, the template refers to them by their original names
+        :param names:   function returning the name for the compiled code by the name used in the template
+        """
+        self.iteration_template = TemplatePart(self.rename_iteration_variables(self.body, names))
+        self.iterkey, self.iterval = names(self.iterkey), names(self.iterval)
+
+    def rename_iteration_variables(self, template, names=None):
+        iterkey, iterval = (names(self.iterkey), names(self.iterval)) if names else (self.iterkey, self.iterval)
+
         # converting nested lists iterables
         template = re.sub(
             '''\sin=["|']%s(.*?)["|']''' % self.iterval,
             lambda m: " in='%s[%s]%s'" % (
                 self.iterable_name,
-                self.iterkey if self.iterkey is not None else self.iterval,
+                iterkey if iterkey is not None else iterval,
                 m.group(1)
             ),
             template
@@ -312,7 +338,7 @@ class List(XmlTag):
             '''>%s(\..+?)?<''' % self.iterval,
             lambda m: ">%s[%s]%s<" % (
                 self.iterable_name,
-                self.iterkey if self.iterkey is not None else self.iterval,
+                iterkey if iterkey is not None else iterval,
                 m.group(1) if m.group(1) else ""
             ),
             template
@@ -321,7 +347,7 @@ class List(XmlTag):
         # iteration counter
         template = re.sub(
             "<var(?P<counter>(_\d+)?)>i</var(?P=counter)>",
-            lambda m: "<iterationkey type='key' mod=' + 1' name='%s'></iterationkey>" % self.iterval,
+            lambda m: "<iterationkey type='key' mod=' + 1' name='%s'></iterationkey>" % iterval,
             template
         )
 
@@ -330,7 +356,7 @@ class List(XmlTag):
             "<var(?P<counter>(?:_[\d]+)?)([^>]*)?>%s([.|\[][^<]+)?</var(?P=counter)>" % self.iterval,
             lambda m: "<iterationvar type='value' in='%s' name='%s' path='%s'%s></iterationvar>" % (
                 self.iterable_name,
-                self.iterkey if self.iterkey is not None else self.iterval,
+                iterkey if iterkey is not None else iterval,
                 m.group(3),
                 m.group(2) if m.group(2) is not None else ""
             ),
@@ -341,7 +367,7 @@ class List(XmlTag):
         if self.dict_iteration:
             template = re.sub(
                 "<var(?P<counter>(?:[_\d])*)>%s</var(?P=counter)>" % self.iterkey,
-                lambda m: "<iterationkey type='key' name='%s'></iterationkey>" % self.iterkey,
+                lambda m: "<iterationkey type='key' name='%s'></iterationkey>" % iterkey,
                 template
             )
         return template
@@ -356,9 +382,36 @@ class Breakpoint(XmlTag):
         self.template_data = lambda d: tag_string.replace(self.body, "")
 
 
+class Flush(XmlTag):
+    """ Represents a point where streamed result should be sent to the client (<flush/>) """
+    pass
+
+
+class Environment(XmlTag):
+    """ Represents the point where suit_environment is injected into the page (it is placed by the compiler) """
+    pass
+
+
+class Cache(XmlTag):
+    """ Represents a fragment which is rendered once per key and then taken from the cache for ttl seconds """
+
+    def __init__(self, tag_string):
+        super().__init__(tag_string)
+        if self.attributes.get("key") is None:
+            raise TemplateParseError("cache tag requires the key attribute: %s" % tag_string)
+        self.key = TemplatePart(self.attributes.get("key"))
+        ttl = self.attributes.get("ttl")
+        try:
+            self.ttl = float(ttl) if ttl is not None else None
+        except ValueError:
+            raise TemplateParseError("ttl of the cache tag must be a number of seconds: %s" % ttl)
+        self.content = TemplatePart(self.body)
+
+
 SuitTagsMap = {
     "var": Variable, "iterationvar": IterationVariable, "iterationkey": IterationKey,
-    "if": Condition, "list": List, "expression": Expression, "breakpoint": Breakpoint
+    "if": Condition, "list": List, "expression": Expression, "breakpoint": Breakpoint, "flush": Flush,
+    "environment": Environment, "cache": Cache
 }
 
 
@@ -460,6 +513,7 @@ class Template(object):
         os.chdir(initial_dir)
 
         self.content = re.sub("<!--(.+?)-->", "", self.content)  # cut all comments
+        self.content = re.sub("<flush\s*/>", "<flush></flush>", self.content)  # self-closing form of <flush>
         self.css, self.js = None, None
         self.parse_resources("css", "<style(?:\s.+?)*>(.*?)</style>")  # cut & save css
         self.parse_resources("js", "<script>(.*?)</script>")  # cut & save js
@@ -521,26 +575,160 @@ class Template(object):
             self.content
         )
 
+    def runtime_includes(self):
+        """ Returns names of the templates included at runtime (includes with their own data) """
+        return [
+            name.strip("'").strip("\"")
+            for name in re.findall('<breakpoint(?:_\d+)?\s+include=(.+?)>', self.content, re.DOTALL)
+        ]
+
+    def auto_refresh_keys(self, visited=None):
+        """
+        Collects the variables listed in auto-refresh="a,b" attributes of the template
+        and of the templates included by it at runtime
+        :return:    set of the variable names ("*" stands for the lists which are known at runtime only),
+                    None if there are no auto-refresh blocks at all
+        """
+        keys = None
+        if "auto-refresh" in self.content:
+            values = re.findall('auto-refresh=(?P<quote>"|\')(.*?)(?P=quote)', self.content, re.DOTALL)
+            keys = {key.strip() for _, value in values for key in value.split(",")}
+            if len(values) != self.content.count("auto-refresh") or any("<" in key for key in keys):
+                keys.add("*")
+        visited = visited if visited is not None else set()
+        for name in self.runtime_includes():
+            if name not in visited:
+                visited.add(name)
+                try:
+                    included = Template(name.replace(".", "/") + ".html").auto_refresh_keys(visited)
+                except TemplateNotFound:
+                    included = None
+                if included is not None:
+                    keys = included if keys is None else keys | included
+        return keys
+
+    def variables(self, visited=None):
+        """
+        Collects the data variables used by the template and by the templates included by it at runtime:
+        the client side refreshes any of them with suit.environment as their data
+        :return:    set of the top-level names of the variables, None if some of them are known at runtime only
+        """
+        variables = self.tag_variables(TemplatePart(self.content))
+        if variables is None:
+            return None
+        visited = visited if visited is not None else set()
+        for name in self.runtime_includes():
+            if name not in visited:
+                visited.add(name)
+                try:
+                    included = Template(name.replace(".", "/") + ".html").variables(visited)
+                except TemplateNotFound:
+                    return None
+                if included is None:
+                    return None
+                variables |= included
+        return variables
+
+    @staticmethod
+    def tag_variables(template_part):
+        """
+        Collects the top-level names of the variables used by the tags of the template part: names of the variables,
+        their defaults and filters' data, conditions, lists' iterables, bodies of the tags and includes' data
+        :return:    set of the names, None if some of them are known at runtime only
+        """
+        variables = set()
+        for tag in template_part.getTags():
+            if isinstance(tag, (IterationVariable, IterationKey)):
+                continue
+            parts = [value for value in tag.attributes.values() if "<" in value]
+            if isinstance(tag, Variable):
+                if "<" in tag.body:
+                    return None
+                variables.add(re.split("[.\\[]", tag.body, 1)[0].strip())
+            else:
+                parts.append(tag.body)
+                if isinstance(tag, List) and "<" not in tag.attributes.get("in"):
+                    variables.add(re.split("[.\\[]", tag.attributes.get("in"), 1)[0].strip())
+            for part in parts:
+                nested = Template.tag_variables(TemplatePart(part))
+                if nested is None:
+                    return None
+                variables |= nested
+        return variables
+
+    def environment(self):
+        """
+        Decides whether the page should get suit_environment (internal.data, suit.environment and auto-refresh
+        on the client side): it must be a html document with auto-refresh blocks
+        :return:    (environment, keys) where environment is True if the insertion point is compiled into the template,
+                    False if suit_environment is not needed, None if it is to be decided at runtime (there is
+                    no </head> in the template itself or the auto-refresh blocks are not emitted on every
+                    execution: they are in the conditions, lists or cached fragments); keys is the tuple
+                    of the variables to be passed to the client or None if the whole data is needed
+        """
+        if not self.content.lstrip().startswith("<!DOCTYPE html>"):
+            return False, None
+        keys = self.auto_refresh_keys()
+        if keys is None:
+            return False, None
+        variables = self.variables()
+        keys = None if "*" in keys or variables is None else tuple(sorted((keys | variables) - {""}))
+        static = "</head>" in self.content and self.emits("auto-refresh")
+        return (True if static else None), keys
+
+    def emits(self, text, template_part=None, visited=None):
+        """
+        Checks whether the text is emitted on every execution of the template: it is in the template itself,
+        in its breakpoints or in the templates included by them, not in the conditions, lists or cached fragments
+        """
+        template_part = template_part if template_part is not None else TemplatePart(self.content)
+        if text in template_part.getText():
+            return True
+        visited = visited if visited is not None else set()
+        for tag in template_part.getTags():
+            if not isinstance(tag, Breakpoint):
+                continue
+            if not tag.isInclude:
+                if self.emits(text, tag.content, visited):
+                    return True
+                continue
+            name = tag.template_name.strip("'").strip("\"")
+            if name in visited:
+                continue
+            visited.add(name)
+            try:
+                included = Template(name.replace(".", "/") + ".html")
+            except TemplateNotFound:
+                continue
+            if included.emits(text, visited=visited):
+                return True
+        return False
+
     def compile(self, languageEnginesMap):
         """
         Compiles itself into source code according given map
         :param languageEnginesMap:
         :return:
         """
-        template_part = TemplatePart(self.content)
+        environment, environment_keys = self.environment()
+        if environment:
+            point = '<environment keys="%s"></environment>' % ",".join(environment_keys) \
+                if environment_keys is not None else "<environment></environment>"
+            template_part = TemplatePart(self.content.replace("</head>", point + "</head>"))
+        else:
+            template_part = TemplatePart(self.content)
+        engines = {language: languageEnginesMap[language]() for language in languageEnginesMap}
+        for engine in engines.values():
+            engine.prepare(self)
         compiled = {
-            language: languageEnginesMap[language]().compile(
+            language: engines[language].compile(
                 template_part.getDataForCompile()
-            ) for language in languageEnginesMap
+            ) for language in engines
         }
 
         # Compiling python source
         templateName = self.templateName.replace(".html", "").replace("/", "_")
-        pythonSource = "from suit.Suit import Suit, SuitRunTime, SuitNone, SuitFilters\n" \
-                       "class %s(object):\n" \
-                       "\tdef execute(self, data={}):\n" \
-                       "\t\tself.data = data\n" \
-                       "\t\treturn (%s)" % (templateName, compiled["py"])
+        pythonSource = engines["py"].module(templateName, compiled["py"], environment, environment_keys)
         f = open("__py__/%s" % self.templateName.replace("/", "_").replace("html", "py"), "w+")
         f.writelines(pythonSource)
         f.close()
@@ -568,47 +756,76 @@ class Template(object):
 class Syntax(metaclass=ABCMeta):
     """ Abstract Class For Creating Language Engines """
 
+    # names used by the compiled code, iteration variables are renamed not to clash with them
+    reserved_names = []
+
+    def __init__(self):
+        # paths of the items of the enclosing lists and local variables bound to them
+        self.bindings = []
+        # name of the compiled template and number of its <cache> tags, which scope the keys of the fragments
+        self.cache_namespace, self.cache_tags = "<template>", 0
+
+    def prepare(self, template):
+        """
+        Receives the template before it is compiled by the engine
+        :param template:    Template instance (its name and the source after rebase and static includes)
+        """
+        self.cache_namespace = template.templateName.replace(".html", "").replace("/", ".")
+
+    def cache_scope(self):
+        """
+        Returns the scope of the next <cache> tag: the name of the template and the ordinal of the tag in it,
+        so the fragments of different tags are not mixed up when their keys are the same
+        """
+        self.cache_tags += 1
+        return "%s:%d" % (self.cache_namespace, self.cache_tags)
+
     def try_compile(self, text):
         """ Tries to compile given string """
         if text is not None:
             return self.compile(TemplatePart(text).getDataForCompile())
 
-    def compile_tag(self, tag):
+    def filter_data(self, filter_name, filter_data):
+        """ Compiles the data of the filter (*-data attribute) """
+        return self.try_compile(filter_data)
+
+    def compile_code(self, data):
+        """
+        Compiles template part which represents a piece of code in the target language (condition, expression)
+        By default it is compiled as an ordinary string and evaluated at runtime
+        """
+        return self.compile(data)
+
+    def compile_tag(self, tag, without_stringify=False):
         """ Compiles given SuitTag into source code """
 
         if isinstance(tag, IterationKey):
             return tag.var_name
 
-        elif isinstance(tag, IterationVariable):
+        elif isinstance(tag, (IterationVariable, Variable)):
             filters = [
-                lambda var: self.filter(filter_name, var, self.try_compile(filter_data))
-                for filter_name, filter_data in tag.filters
+                lambda var, filter_name=filter_name, filter_data=filter_data: self.filter(
+                    filter_name, var, self.filter_data(filter_name, filter_data)
+                ) for filter_name, filter_data in tag.filters
             ]
-            return self.var(tag.var_name, filters, self.try_compile(tag.default))
-
-        elif isinstance(tag, Variable):
-            filters = [
-                lambda var: self.filter(filter_name, var, self.try_compile(filter_data))
-                for filter_name, filter_data in tag.filters
-            ]
-            return self.var(tag.var_name, filters, self.try_compile(tag.default))
+            return self.var(tag.var_name, filters, self.try_compile(tag.default), without_stringify)
 
         elif isinstance(tag, Condition):
             return self.condition(
-                self.compile(tag.condition.getDataForCompile()),
+                self.compile_code(tag.condition.getDataForCompile()),
                 self.compile(tag.true.getDataForCompile()),
                 self.compile(tag.false.getDataForCompile())
             )
 
         elif isinstance(tag, List):
-            return self.list(
-                self.compile(tag.iteration_template.getDataForCompile()),
-                tag.iterkey,
-                self.var(tag.iterable.var_name, without_stringify=True)
-            )
+            self.rename_iteration_variables(tag)
+            iterable = self.var(tag.iterable.var_name, without_stringify=True)
+            with self.binding(tag):
+                template = self.compile(tag.iteration_template.getDataForCompile())
+            return self.list(template, tag.iterkey, iterable)
 
         elif isinstance(tag, Expression):
-            return self.expression(self.compile(tag.expresion_body.getDataForCompile()))
+            return self.expression(self.compile_code(tag.expresion_body.getDataForCompile()))
 
         elif isinstance(tag, Breakpoint):
             if tag.body and tag.body.startswith("{"):
@@ -616,6 +833,19 @@ class Syntax(metaclass=ABCMeta):
             else:
                 return self.compile(tag.content.getDataForCompile())
 
+        elif isinstance(tag, Flush):
+            return self.flush()
+
+        elif isinstance(tag, Environment):
+            keys = tag.get("keys")
+            return self.environment(tuple(key for key in keys.split(",") if key) if keys is not None else None)
+
+        elif isinstance(tag, Cache):
+            return self.cache(
+                self.cache_scope(), self.compile(tag.key.getDataForCompile()), tag.ttl,
+                self.compile(tag.content.getDataForCompile())
+            )
+
         else:
             raise None
 
@@ -651,6 +881,62 @@ class Syntax(metaclass=ABCMeta):
     def filter(self, filterName, var, data=None):
         pass
 
+    def flush(self):
+        """ Flush points make sense for streamed execution only, so by default they produce nothing """
+        return '""'
+
+    def environment(self, keys=None):
+        """
+        suit_environment is injected on the server side only, so by default it produces nothing
+        :param keys:    variables to be passed to the client (None for the whole data)
+        """
+        return '""'
+
+    def cache(self, scope, key, ttl, template):
+        """
+        Compiles the cached fragment, by default it is rendered on every execution
+        :param scope:       scope of the fragment's key (see cache_scope())
+        :param key:         compiled key of the fragment
+        :param ttl:         seconds the fragment is kept for (None to keep it until it is evicted)
+        :param template:    compiled body of the fragment
+        """
+        return template
+
+    def reserved(self, name):
+        """ Whether the iteration variable's name clashes with the names used by the compiled code """
+        return name in self.reserved_names
+
+    def rename_iteration_variables(self, tag):
+        """ Renames the iteration variables of the list which clash with the names used by the compiled code """
+        if self.reserved(tag.iterkey) or self.reserved(tag.iterval):
+            tag.rename(lambda name: "_it_%s" % name if self.reserved(name) else name)
+
+    @staticmethod
+    def local(itervar):
+        """ Returns the name of the local variable bound to the item of the list """
+        return "_%s_value" % itervar
+
+    @contextmanager
+    def binding(self, tag):
+        """ Binds the item of the list to the local variable while the list's body is compiled """
+        self.bindings.append(("%s[%s]" % (tag.iterable.var_name, tag.iterkey), self.local(tag.iterkey)))
+        try:
+            yield
+        finally:
+            self.bindings.pop()
+
+    def bind(self, var_name):
+        """
+        Returns the local variable bound to the list's item which the variable belongs to and the rest of its path,
+        so the item is not looked up from the root of the template's data on every access
+        :param var_name:    path of the variable in brackets-notation: ["items"][item]["name"]
+        :return: tuple:     ("_item_value", '["name"]') or (None, var_name) if the variable is not a list's item
+        """
+        for path, local in reversed(self.bindings):
+            if var_name == path or var_name.startswith(path + "["):
+                return local, var_name[len(path):]
+        return None, var_name
+
     def logicand(self):
         return "&&"
 
@@ -669,6 +955,121 @@ class PythonSyntax(Syntax):
     Класс, обеспечивающий возможность компиляции шаблонов в исходный код python
     """
 
+    # name of the object available in the compiled code and the way to reach template's data from it
+    context, context_data = "ctx", "ctx"
+
+    reserved_names = ["ctx", "str", "Suit", "SuitRunTime", "SuitNone", "SuitFilters"]
+
+    # filters which parse their data as json
+    json_filters = ("in", "notin", "plural_form")
+
+    def __init__(self):
+        super().__init__()
+        self.accessors = OrderedDict()
+        self.constants = OrderedDict()
+
+    def reserved(self, name):
+        # names of the locals generated by the compiler start with the underscore
+        return name in self.reserved_names or name.startswith("_") or iskeyword(name)
+
+    def module(self, class_name, compiled, environment=False, environment_keys=None):
+        """
+        Returns source code of the python module with compiled template
+        :param class_name:          name of the template class
+        :param compiled:            compiled template
+        :param environment:         whether the template injects suit_environment (see Template.environment())
+        :param environment_keys:    variables passed to the client with suit_environment (None for the whole data)
+        :return: str:
+        """
+        return "from suit.Suit import Suit, SuitRunTime, SuitNone, SuitFilters\n" \
+               "%s\n" \
+               "render = lambda ctx: (%s)\n\n\n" \
+               "class %s(object):\n" \
+               "\tenvironment = %r\n" \
+               "\tenvironment_keys = %r\n" \
+               "\trender = staticmethod(render)\n\n" \
+               "\tdef execute(self, data={}):\n" \
+               "\t\treturn render(data)" % (
+                   self.accessors_source(), compiled, class_name, environment, environment_keys
+               )
+
+    def accessor(self, var_name, root=None):
+        """
+        Returns the call of the function that reads the variable from the template's data
+        Such function is generated once for every path: it walks the path with the checks of dicts and lists
+        and returns None if the variable is missing, so there are no exceptions raised in common cases
+        :param var_name:    path of the variable in brackets-notation: ["items"][item]["name"]
+        :param root:        object the path starts from, the template's data by default
+        :return: str:       call of the accessor or None if the path can't be walked by the accessor
+        """
+        root = root or self.context_data
+        if not var_name:
+            return root
+        keys = re.findall('\\[([^\\[\\]]+)\\]', var_name)
+        if "".join("[%s]" % key for key in keys) != var_name or not all(
+                re.match('^(?:"[^"\\\\]*"|-?\\d+|[A-Za-z_]\\w*)$', key) for key in keys):
+            return None
+        args = [key for key in keys if key[0].isalpha() or key[0] == "_"]
+        args = sorted(set(args), key=args.index)
+        if any(iskeyword(arg) or arg == "_v" for arg in args):
+            return None
+        if var_name not in self.accessors:
+            self.accessors[var_name] = ("_var%d" % len(self.accessors), keys, args)
+        return "%s(%s)" % (self.accessors[var_name][0], ", ".join([root] + args))
+
+    def filter_data(self, filter_name, filter_data):
+        """
+        Compiles the data of the filter
+        Json literals of the filters parsing their data are parsed at compile time into the module's constants,
+        sets of hashable values for in/notin are frozen, so the membership is tested by hash
+        """
+        if filter_name in self.json_filters and filter_data is not None and \
+                not TemplatePart(filter_data).getDataForCompile()[1]:
+            try:
+                value = json.loads(filter_data, parse_constant=_reject_constant)
+            except ValueError:
+                value = None
+            if isinstance(value, (list, dict)):
+                if filter_name != "plural_form":
+                    try:
+                        value = frozenset(value)
+                    except TypeError:
+                        pass
+                elif isinstance(value, list):
+                    # hashable, so the results of the filter can be memoized
+                    value = tuple(value)
+                return self.constant(value)
+        return self.try_compile(filter_data)
+
+    def constant(self, value):
+        """ Returns the name of the module's constant with given value """
+        if isinstance(value, frozenset) and value:
+            # repr() of a set follows the string hashes, which are randomized per process
+            source = "frozenset({%s})" % ", ".join(sorted(map(repr, value)))
+        else:
+            source = repr(value)
+        if source not in self.constants:
+            self.constants[source] = "_const%d" % len(self.constants)
+        return self.constants[source]
+
+    def accessors_source(self):
+        """ Returns source code of the accessors and constants used by compiled template """
+        functions = ["%s = %s" % (name, source) for source, name in self.constants.items()]
+        for name, keys, args in self.accessors.values():
+            lines = ["def %s(%s):" % (name, ", ".join(["_v"] + args))]
+            for key in keys:
+                if key.startswith('"'):
+                    step = "_v.get({0}) if _v.__class__ is dict else SuitRunTime.item(_v, {0})"
+                elif key in args:
+                    step = "_v[{0}] if _v.__class__ is list and {0}.__class__ is int and -len(_v) <= {0} < len(_v) " \
+                           "else SuitRunTime.item(_v, {0})"
+                else:
+                    step = "_v[{0}] if _v.__class__ is list and -len(_v) <= {0} < len(_v) else SuitRunTime.item(_v, {0})"
+                lines.append("    _v = %s" % step.format(key))
+            lines.append("    return _v")
+            functions.append("\n".join(lines))
+        return "\n\n\n".join(functions)
+
     def compile(self, data):
         template, tags = data
         template = template.replace('"', '\\"')
@@ -682,13 +1083,107 @@ class PythonSyntax(Syntax):
     def convertplaceholders(self, template):
         return re.sub("\{\{ph:\d+\}\}", "%s", template)
 
+    def compile_code(self, data):
+        """
+        Compiles template part into a native python expression:
+        the text is kept as python source and every tag becomes a value passed through SuitRunTime.literal,
+        so nothing has to be formatted and evaluated at runtime
+        """
+        template, tags = data
+        tags = [self.compile_tag(tag, without_stringify=True) for tag in tags]
+        code = []
+        for part in re.split('''("(?:[^"\\\\]|\\\\.)*"|'(?:[^'\\\\]|\\\\.)*')''', template):
+            if part[:1] in ["'", '"']:
+                # placeholders inside of the string literals are substituted by their textual values
+                quote, pieces = part[0], re.split("\{\{ph:(\d+)\}\}", part[1:-1])
+                if len(pieces) > 1:
+                    part = "(%s)" % " + ".join(
+                        "str(SuitRunTime.stringify(%s))" % tags[int(piece)] if num % 2 else quote + piece + quote
+                        for num, piece in enumerate(pieces) if piece
+                    )
+            else:
+                part = part.replace("&&", " %s " % self.logicand()).replace("||", " %s " % self.logicor())
+                part = re.sub("\\btrue\\b", self.true(), part)
+                part = re.sub("\\bfalse\\b", self.false(), part)
+                part = re.sub("\{\{ph:(\d+)\}\}", lambda m: "SuitRunTime.literal(%s)" % tags[int(m.group(1))], part)
+            code.append(part)
+        return "(%s)" % "".join(code)
+
+    def scope(self, bp_body):
+        """
+        Compiles include's data block ({"key": "<var>value</var>", ...}) into the python expression building the dict,
+        so the block is not rendered into json and parsed on every execution
+        Tags inside of the string literals are substituted by their textual values,
+        tags outside of them (json values) are passed as they are
+        :param bp_body: include's data block
+        :return: str:   python expression
+        """
+        template, tags = TemplatePart(bp_body).getDataForCompile()
+        tags = [self.compile_tag(tag, without_stringify=True) for tag in tags]
+        values = []
+
+        def value(match):
+            values.append(match.group(0))
+            return '"\ue001%d\ue001"' % (len(values) - 1)
+
+        # json values with tags are replaced with the string markers, tags inside of the strings with the plain ones
+        template = "".join(
+            re.sub("\{\{ph:(\d+)\}\}", "\ue000\\1\ue000", part) if num % 2 else re.sub(
+                '[^\\s,:\\[\\]{}"]*(?:\\{\\{ph:\\d+\\}\\}[^\\s,:\\[\\]{}"]*)+', value, part
+            ) for num, part in enumerate(re.split('("(?:[^"\\\\]|\\\\.)*")', template))
+        )
+        try:
+            data = json.loads(template, object_pairs_hook=OrderedDict)
+        except ValueError as e:
+            raise TemplateParseError("invalid include's data %s: %s" % (bp_body, e))
+        if not isinstance(data, dict):
+            raise TemplateParseError("include's data must be an object: %s" % bp_body)
+
+        def text(string):
+            pieces = re.split("\ue000(\\d+)\ue000", string)
+            return " + ".join(
+                "str(SuitRunTime.stringify(%s))" % tags[int(piece)] if num % 2 else repr(piece)
+                for num, piece in enumerate(pieces) if piece or len(pieces) == 1
+            )
+
+        def code(obj):
+            if isinstance(obj, dict):
+                return "{%s}" % ", ".join("%s: %s" % (code(key), code(val)) for key, val in obj.items())
+            if isinstance(obj, list):
+                return "[%s]" % ", ".join(code(val) for val in obj)
+            if isinstance(obj, str):
+                raw = re.match("^\ue001(\\d+)\ue001$", obj)
+                if raw:
+                    pieces = re.split("\\{\\{ph:(\\d+)\\}\\}", values[int(raw.group(1))])
+                    if pieces[0] == pieces[-1] == "" and len(pieces) == 3:
+                        return "SuitRunTime.scope_value(%s)" % tags[int(pieces[1])]
+                    return "SuitRunTime.scope_value(%s)" % text("".join(
+                        "\ue000%s\ue000" % piece if num % 2 else piece for num, piece in enumerate(pieces)
+                    ))
+                return text(obj)
+            return repr(obj)
+
+        return code(data)
+
     def include(self, bp_name, bp_body):
-        return "SuitRunTime.include({}, '%s', lambda: self.data, '%s')" % (bp_name, bp_body)
+        return "SuitRunTime.include({}, '%s', lambda: %s, lambda: %s)" % (
+            bp_name, self.context_data, self.scope(bp_body)
+        )
 
     def var(self, var_name, filters=None, default=None, without_stringify=False):
         if filters is None:
             filters = []
-        res = "SuitRunTime.var(lambda self: self.data%s, %s, self)" % (var_name, default)
+        root, path = self.bind(var_name)
+        accessor = self.accessor(path, root)
+        if accessor:
+            # the default is evaluated only when the variable is missing
+            res = "(SuitRunTime.value(_v) if (_v := %s) is not None else %s)" % (
+                accessor, default if default is not None else "SuitNone()"
+            )
+        else:
+            res = "SuitRunTime.var(lambda %s: %s%s, %s, %s)" % (
+                self.context, root or self.context_data, path, default, self.context
+            )
         for filter_lambda in filters:
             res = filter_lambda(res)
         if without_stringify is False:
@@ -697,11 +1192,7 @@ class PythonSyntax(Syntax):
             return res
 
     def condition(self, condition, true, false):
-        condition = condition.replace("&&", self.logicand())
-        condition = condition.replace("||", self.logicor())
-        condition = condition.replace("true", self.true())
-        condition = condition.replace("false", self.false())
-        return '''SuitRunTime.opt(%s, lambda: %s, lambda: %s)''' % (condition, true, false if false else "")
+        return '''(%s if %s else %s)''' % (true, condition, false if false else '""')
 
     def list(self, template, itervar, iterable):
         inc_data = re.search("SuitRunTime.include\(({.*?}), ", template, re.DOTALL)
@@ -712,16 +1203,22 @@ class PythonSyntax(Syntax):
             new_inc_data = '{%s}' % iter_addition if len(inc_data) == 2 else inc_data.rstrip(
                 "}") + ", " + iter_addition + "}"
         template = template.replace("SuitRunTime.include(%s, " % inc_data, "SuitRunTime.include(%s, " % new_inc_data)
-        return '''SuitRunTime.list(lambda %s: %s, %s)''' % (itervar, template, iterable)
+        return '''SuitRunTime.each(lambda %s, %s: %s, %s)''' % (itervar, self.local(itervar), template, iterable)
 
     def expression(self, expression):
-        return "SuitRunTime.expression(%s)" % expression
+        return expression
+
+    def environment(self, keys=None):
+        return "SuitRunTime.environment(%s, %r)" % (self.context_data, keys)
+
+    def cache(self, scope, key, ttl, template):
+        return "SuitRunTime.cache((%r, %s), %r, lambda: %s)" % (scope, key, ttl, template)
 
     def filter(self, filterName, var, data=None):
         if data is None:
-            return '''SuitFilters._%s(%s)''' % (filterName, var)
+            return '''SuitFilters.registry["%s"].function(%s)''' % (filterName, var)
         else:
-            return '''SuitFilters._%s(%s, %s)''' % (filterName, var, data)
+            return '''SuitFilters.registry["%s"].function(%s, %s)''' % (filterName, var, data)
 
     def logicand(self):
         return "and"
@@ -736,6 +1233,437 @@ class PythonSyntax(Syntax):
         return "False"
 
 
+class PythonRenderExpressions(PythonSyntax):
+    """ Compiles expressions (conditions, defaults, filters data) used inside of the python render functions """
+
+    def __init__(self):
+        super().__init__()
+        self.keys = set()
+        # whether the results of the filters are memoized during the render (_m dict of the render function)
+        self.memo = False
+
+    def filter(self, filterName, var, data=None):
+        if not SuitFilters.memoized(filterName):
+            return super().filter(filterName, var, data)
+        self.memo = True
+        if data is None:
+            return '''SuitFilters.cached(_m, "%s", %s)''' % (filterName, var)
+        return '''SuitFilters.cached(_m, "%s", %s, %s)''' % (filterName, var, data)
+
+    def var(self, var_name, filters=None, default=None, without_stringify=False):
+        self.use(var_name)
+        return super().var(var_name, filters, default, without_stringify)
+
+    def use(self, var_name):
+        """ Remembers the key of the template's data used by the compiled code """
+        key = re.match('\\["(.+?)"\\]', var_name)
+        if key:
+            self.keys.add(key.group(1))
+
+
+class PythonRenderSyntax(Syntax):
+    """
+    Класс, обеспечивающий возможность компиляции шаблонов в python-функции render(ctx)
+    Вместо одного вложенного выражения генерируется последовательный код: куски текста и значения переменных
+    добавляются в список, который объединяется один раз, условия и циклы становятся обычными if и for
+    Из того же кода строится генератор render_iter(ctx), который отдает результат частями по мере выполнения,
+    и корутина render_async(ctx), которая дожидается только тех значений данных, которые используются шаблоном
+
+    Statements that differ between render, render_iter and render_async are emitted as markers:
+        @flush          point where render_iter may yield accumulated chunks (the end of a list iteration)
+        @flush!         point where render_iter must yield accumulated chunks (<flush/> tag)
+        @await keys     point where render_async resolves awaitable values of the keys used by the next statement
+        @include args   execution of the included template with SuitRunTime.include(args)
+        @environment keys   injection of suit_environment, render_async resolves the values to be passed before it
+        @include! args  execution of the included template inside of <cache>, it is never streamed
+        @fragment key, start, ttl   caching of the chunks accumulated since start, render_async awaits includes first
+    """
+
+    reserved_names = PythonSyntax.reserved_names
+    reserved = PythonSyntax.reserved
+
+    def __init__(self):
+        super().__init__()
+        self.expressions = PythonRenderExpressions()
+        self.expressions.bindings = self.bindings
+        self.iterkeys = []
+        self.resolved = set()
+        self.fragments = 0
+
+    def module(self, class_name, compiled, environment=False, environment_keys=None):
+        """
+        Returns source code of the python module with compiled template
+        :param class_name:          name of the template class
+        :param compiled:            list of the render function statements
+        :param environment:         whether the template injects suit_environment (see Template.environment())
+        :param environment_keys:    variables passed to the client with suit_environment (None for the whole data)
+        :return: str:
+        """
+        if self.expressions.memo:
+            compiled = ["_m = {}"] + compiled
+        return "from suit.Suit import Suit, SuitRunTime, SuitNone, SuitFilters\n\n\n" \
+               "%s\n\n\n" \
+               "def render(ctx):\n" \
+               "    _c = []\n" \
+               "    _a = _c.append\n" \
+               "%s\n" \
+               "    return \"\".join(_c)\n\n\n" \
+               "def render_iter(ctx):\n" \
+               "    _c = []\n" \
+               "    _a = _c.append\n" \
+               "%s\n" \
+               "    if _c:\n" \
+               "        yield \"\".join(_c)\n\n\n" \
+               "async def render_async(ctx):\n" \
+               "    _c = []\n" \
+               "    _a = _c.append\n" \
+               "    try:\n" \
+               "%s\n" \
+               "        return await SuitRunTime.join_async(_c)\n" \
+               "    finally:\n" \
+               "        SuitRunTime.cancel(_c)\n\n\n" \
+               "class %s(object):\n" \
+               "    environment = %r\n" \
+               "    environment_keys = %r\n" \
+               "    render = staticmethod(render)\n" \
+               "    render_iter = staticmethod(render_iter)\n" \
+               "    render_async = staticmethod(render_async)\n\n" \
+               "    def execute(self, data={}):\n" \
+               "        return render(data)\n\n" \
+               "    def execute_iter(self, data={}):\n" \
+               "        return render_iter(data)\n\n" \
+               "    def execute_async(self, data={}):\n" \
+               "        return render_async(data)\n" % (
+                   self.expressions.accessors_source(),
+                   "\n".join(self.expand_markers(self.indent(compiled), "render")),
+                   "\n".join(self.expand_markers(self.indent(compiled), "render_iter")),
+                   "\n".join(self.expand_markers(self.indent(compiled, "    "), "render_async")),
+                   class_name,
+                   environment,
+                   environment_keys
+               )
+
+    def expand_markers(self, lines, function):
+        """
+        Replaces markers with the statements of the given function
+        :param lines:       list of statements
+        :param function:    kind of the function: render, render_iter or render_async
+        :return: list:
+        """
+        streaming = function == "render_iter"
+        result = []
+        for line in lines:
+            statement = line.lstrip()
+            indent = line[:len(line) - len(statement)]
+            if statement == "@flush":
+                if streaming:
+                    result += [indent + "if len(_c) >= SuitRunTime.stream_buffer:"] + self.indent(self.chunk(), indent)
+            elif statement == "@flush!":
+                if streaming:
+                    result += [indent + "if _c:"] + self.indent(self.chunk(), indent)
+            elif statement.startswith("@await "):
+                if function == "render_async":
+                    result.append(indent + "await SuitRunTime.resolve(ctx, (%s,))" % statement[len("@await "):])
+            elif statement.startswith("@environment "):
+                keys = statement[len("@environment "):]
+                if function == "render_async":
+                    resolved = keys if keys != "None" else "tuple(ctx)"
+                    result.append(indent + "await SuitRunTime.resolve(ctx, %s)" % resolved)
+                result.append(indent + "_a(SuitRunTime.environment(ctx, %s))" % keys)
+            elif statement.startswith("@include! "):
+                args = statement[len("@include! "):]
+                if function == "render_async":
+                    result.append(indent + "_a(SuitRunTime.include_async(%s))" % args)
+                else:
+                    result.append(indent + "_a(SuitRunTime.include(%s))" % args)
+            elif statement.startswith("@fragment "):
+                key, start, ttl = statement[len("@fragment "):].split(", ")
+                if function == "render_async":
+                    result.append(indent + "_c[%s:] = [await SuitRunTime.join_async(_c[%s:])]" % (start, start))
+                result.append(indent + 'Suit.fragments.set(%s, "".join(_c[%s:]), %s)' % (key, start, ttl))
+            elif statement.startswith("@include "):
+                args = statement[len("@include "):]
+                if streaming:
+                    result += [indent + "if _c:"] + self.indent(self.chunk(), indent)
+                    result.append(indent + "yield from SuitRunTime.include_iter(%s)" % args)
+                elif function == "render_async":
+                    result.append(indent + "_a(SuitRunTime.include_async(%s))" % args)
+                else:
+                    result.append(indent + "_a(SuitRunTime.include(%s))" % args)
+            else:
+                result.append(line)
+        return result
+
+    def chunk(self):
+        """ Statements of render_iter which yield accumulated chunks """
+        return ['yield "".join(_c)', "del _c[:]"]
+
+    def block(self, lines):
+        """ Returns body of the compound statement, which stays valid when markers are expanded into nothing """
+        if all(line.startswith(("@flush", "@await")) for line in lines):
+            lines = ["pass"] + lines
+        return lines
+
+    def awaits(self):
+        """
+        Returns the marker which resolves the keys of data used by the statement compiled since the last call
+        Keys that are already resolved on the way to the statement are skipped
+        """
+        keys, self.expressions.keys = self.expressions.keys - self.resolved, set()
+        self.resolved |= keys
+        return ["@await %s" % ", ".join('"%s"' % key for key in sorted(keys))] if keys else []
+
+    def compile_block(self, data):
+        """ Compiles the body of the compound statement, which may be skipped, so its resolved keys are forgotten """
+        resolved = set(self.resolved)
+        try:
+            return self.compile(data)
+        finally:
+            self.resolved = resolved
+
+    def compile(self, data):
+        """ Compiles template part into the list of python statements """
+        template, tags = data
+        lines = []
+        for num, piece in enumerate(re.split("\{\{ph:(\d+)\}\}", template)):
+            if num % 2:
+                lines += self.compile_tag(tags[int(piece)])
+            elif piece:
+                lines.append("_a(%s)" % self.convertplaceholders(piece))
+        return lines
+
+    def compile_tag(self, tag, without_stringify=False):
+        """ Compiles given SuitTag into the list of python statements """
+
+        if isinstance(tag, IterationKey):
+            return ["_a(str(%s))" % tag.var_name]
+
+        elif isinstance(tag, Variable):
+            filters = [
+                lambda var, filter_name=filter_name, filter_data=filter_data: self.filter(
+                    filter_name, var, self.expressions.filter_data(filter_name, filter_data)
+                ) for filter_name, filter_data in tag.filters
+            ]
+            lines = self.var(tag.var_name, filters, self.expressions.try_compile(tag.default))
+            return self.awaits() + lines
+
+        elif isinstance(tag, Condition):
+            condition = self.expressions.compile_code(tag.condition.getDataForCompile())
+            awaits = self.awaits()
+            return awaits + self.condition(
+                condition,
+                self.compile_block(tag.true.getDataForCompile()),
+                self.compile_block(tag.false.getDataForCompile())
+            )
+
+        elif isinstance(tag, List):
+            self.rename_iteration_variables(tag)
+            iterable = self.expressions.var(tag.iterable.var_name, without_stringify=True)
+            awaits = self.awaits()
+            self.iterkeys.append(tag.iterkey)
+            try:
+                with self.binding(tag):
+                    template = self.compile_block(tag.iteration_template.getDataForCompile())
+            finally:
+                self.iterkeys.pop()
+            return awaits + self.list(template, tag.iterkey, iterable)
+
+        elif isinstance(tag, Expression):
+            expression = self.expressions.compile_code(tag.expresion_body.getDataForCompile())
+            return self.awaits() + self.expression(expression)
+
+        elif isinstance(tag, Breakpoint):
+            if tag.body and tag.body.startswith("{"):
+                return self.include(tag.template_name, tag.body)
+            else:
+                return self.compile(tag.content.getDataForCompile())
+
+        elif isinstance(tag, Flush):
+            return self.flush()
+
+        elif isinstance(tag, Environment):
+            keys = tag.get("keys")
+            return self.environment(tuple(key for key in keys.split(",") if key) if keys is not None else None)
+
+        elif isinstance(tag, Cache):
+            key = self.expressions.compile(tag.key.getDataForCompile())
+            awaits = self.awaits()
+            return awaits + self.cache(
+                self.cache_scope(), key, tag.ttl, self.compile_block(tag.content.getDataForCompile())
+            )
+
+        else:
+            raise TemplateParseError("unknown tag: %s" % tag.name)
+
+    def convertplaceholders(self, template):
+        """ Returns python string literal for the piece of template's text """
+        return '"%s"' % template.replace('"', '\\"')
+
+    def indent(self, lines, indent=""):
+        return [indent + "    " + line for line in lines]
+
+    def var(self, var_name, filters=None, default=None, without_stringify=False):
+        self.expressions.use(var_name)
+        value = "SuitRunTime.value(_v) if _v is not None else %s" % (default if default is not None else "SuitNone()")
+        for filter_lambda in filters or []:
+            value = filter_lambda(value)
+        # statements keep direct lookups: try/except costs nothing when the variable is present
+        root, path = self.bind(var_name)
+        if not path:
+            return ["_v = %s" % root, "_a(SuitRunTime.text(%s))" % value]
+        return [
+            "try:",
+            "    _v = %s%s" % (root or "ctx", path),
+            "except SuitRunTime.lookup_errors:",
+            "    _v = None",
+            "_a(SuitRunTime.text(%s))" % value
+        ]
+
+    def include(self, bp_name, bp_body):
+        keys = self.expressions.keys
+        self.expressions.keys = set()
+        try:
+            scope = self.expressions.scope(bp_body)
+        finally:
+            keys, self.expressions.keys = self.expressions.keys, keys
+        # items of the lists are bound to the scope's function, as render_async executes it later
+        bound = ", ".join("%s=%s" % (name, name) for iterkey in self.iterkeys for name in (iterkey, self.local(iterkey)))
+        return ["@include {}, %r, lambda: ctx, lambda%s: %s, %r" % (
+            bp_name, " " + bound if bound else "", scope, tuple(sorted(keys))
+        )]
+
+    def condition(self, condition, true, false):
+        lines = ["if %s:" % condition] + self.indent(self.block(true))
+        if false:
+            lines += ["else:"] + self.indent(self.block(false))
+        return lines
+
+    def list(self, template, itervar, iterable):
+        return ["for %s, %s in SuitRunTime.enumerate(%s):" % (itervar, self.local(itervar), iterable)] + self.indent(
+            self.block(template) + ["@flush"]
+        )
+
+    def expression(self, expression):
+        return ["_a(str(%s))" % expression]
+
+    def filter(self, filterName, var, data=None):
+        return self.expressions.filter(filterName, var, data)
+
+    def flush(self):
+        return ["@flush!"]
+
+    def environment(self, keys=None):
+        return ["@environment %r" % (keys,)]
+
+    def cache(self, scope, key, ttl, template):
+        # the fragment is cached as a whole, so its body is not streamed
+        body = []
+        for line in template:
+            statement = line.lstrip()
+            if statement not in ("@flush", "@flush!"):
+                body.append(line.replace("@include ", "@include! ", 1) if statement.startswith("@include ") else line)
+        self.fragments += 1
+        key_name, start = "_k%d" % self.fragments, "_n%d" % self.fragments
+        return [
+            "%s = (%r, %s)" % (key_name, scope, key),
+            "_f = Suit.fragments.get(%s)" % key_name,
+            "if _f is not None:",
+            "    _a(_f)",
+            "else:",
+            "    %s = len(_c)" % start
+        ] + self.indent(body + ["@fragment %s, %s, %r" % (key_name, start, ttl)])
+
+
+class PythonProfileSyntax(PythonRenderSyntax):
+    """
+    Compiles templates into render functions which report to SuitProfiler: the time and the number of calls
+    are recorded for the template itself and for its lists, conditions, expressions, includes and filtered variables,
+    each of them is identified by the name of the template and the position of the tag in it
+    Templates compiled by PythonRenderSyntax are not instrumented at all, so profiling costs nothing until
+    the templates are compiled with Compiler({"py": PythonProfileSyntax, "js": JavascriptSyntax})
+
+    The time of render_iter includes the time its consumer spends between the chunks,
+    render_async starts includes as tasks, so their time is reported by the included templates only
+    """
+
+    reserved_names = PythonRenderSyntax.reserved_names + ["SuitProfiler"]
+
+    def __init__(self):
+        super().__init__()
+        self.template_name, self.source, self.cursor = "<template>", "", 0
+        self.sites = []
+
+    def prepare(self, template):
+        super().prepare(template)
+        self.template_name, self.source, self.cursor = template.templateName, template.getContent(), 0
+
+    def module(self, class_name, compiled, environment=False, environment_keys=None):
+        compiled = [
+            "_pp = SuitProfiler.path.get() + (%r,)" % self.template_name,
+            "_tp = SuitProfiler.clock()"
+        ] + compiled + ["SuitProfiler.record(_pp, _tp)"]
+        return super().module(class_name, compiled, environment, environment_keys).replace(
+            "SuitFilters\n", "SuitFilters, SuitProfiler\n", 1
+        )
+
+    def compile_tag(self, tag, without_stringify=False):
+        """ Surrounds the statements of the profiled tag with the time measurement """
+        site = self.site(tag)
+        if site is None:
+            return super().compile_tag(tag, without_stringify)
+        self.sites.append(site)
+        try:
+            path = tuple(self.sites)
+            lines = super().compile_tag(tag, without_stringify)
+        finally:
+            self.sites.pop()
+        if isinstance(tag, Breakpoint):
+            # the included template records its tags under the include
+            lines = ["_pi = SuitProfiler.path.get()", "SuitProfiler.path.set(_pp + %r)" % (path,), "try:"] + \
+                self.indent(lines) + ["finally:", "    SuitProfiler.path.set(_pi)"]
+        timer = "_t%d" % len(self.sites)
+        return ["%s = SuitProfiler.clock()" % timer] + lines + ["SuitProfiler.record(_pp + %r, %s)" % (path, timer)]
+
+    def site(self, tag):
+        """
+        Returns the label of the tag in the profiler's reports or None if the tag is not profiled
+        :param tag:     SuitTag
+        :return: str:   'list items (subfolder/page.html:12:5)'
+        """
+        if isinstance(tag, List):
+            label, name = "list %s" % tag.iterable_name, "list"
+        elif isinstance(tag, Condition):
+            label, name = "if", "if"
+        elif isinstance(tag, Expression):
+            label, name = "expression", "expression"
+        elif isinstance(tag, Cache):
+            label, name = "cache", "cache"
+        elif isinstance(tag, Breakpoint) and tag.body and tag.body.startswith("{"):
+            label, name = "include %s" % tag.template_name, "breakpoint"
+        elif isinstance(tag, Variable) and not isinstance(tag, IterationKey) and tag.filters:
+            var_name = re.sub('\\["(.*?)"\\]', lambda m: "." + m.group(1), tag.var_name).lstrip(".")
+            label, name = "var %s|%s" % (var_name, "|".join(filter_name for filter_name, _ in tag.filters)), "var"
+        else:
+            return None
+        return "%s (%s:%d:%d)" % ((label, self.template_name) + self.position(tag, name))
+
+    def position(self, tag, name):
+        """
+        Finds the tag in the template's source: tags are compiled in the order of the source, so the search continues
+        from the previous profiled tag; tags rewritten by the lists are looked up by their name only
+        :param tag:     SuitTag
+        :param name:    name of the tag in the source
+        :return: tuple: (line, column)
+        """
+        index = self.source.find(TagCounter().decount(tag.firstLine), self.cursor)
+        if index < 0:
+            index = self.source.find("<%s" % name, self.cursor)
+        if index < 0:
+            return 0, 0
+        self.cursor = index + 1
+        return self.source.count("\n", 0, index) + 1, index - self.source.rfind("\n", 0, index)
+
+
 class JavascriptSyntax(Syntax):
     """
     Класс, обеспечивающий возможность компиляции шаблонов в исходный код javascript
@@ -763,8 +1691,9 @@ class JavascriptSyntax(Syntax):
     def var(self, var_name, filters=None, default=None, without_stringify=False):
         if filters is None:
             filters = []
-        res = "suit.SuitRunTime.variable(function(){ return data%s; }, %s)" % (
-            var_name, default if default is not None else "null"
+        root, path = self.bind(var_name)
+        res = "suit.SuitRunTime.variable(function(){ return %s%s; }, %s)" % (
+            root or "data", path, default if default is not None else "null"
         )
         for filter_lambda in filters:
             res = filter_lambda(res)
@@ -784,42 +1713,35 @@ class JavascriptSyntax(Syntax):
         template = template.replace("suit.SuitRunTime.include(%s, " % inc_data,
                                     "suit.SuitRunTime.include(%s, " % new_inc_data)
 
-        return '''suit.SuitRunTime.list(function(%s) { return %s; }, (%s))''' % (
-            itervar, template.replace(".%s)" % itervar, "[%s])" % itervar), iterable)
+        return '''suit.SuitRunTime.each(function(%s, %s) { return %s; }, (%s))''' % (
+            itervar, self.local(itervar), template.replace(".%s)" % itervar, "[%s])" % itervar), iterable)
 
     def expression(self, expression):
         return "eval(%s)" % expression
 
+    def cache(self, scope, key, ttl, template):
+        return "suit.SuitRunTime.cache(%s, %s, %s, function() { return %s; })" % (
+            json.dumps(scope), key, "null" if ttl is None else repr(ttl), template
+        )
+
     def filter(self, filterName, var, data=None):
-        if filterName == "length":
-            var = '''suit.SuitFilters.get_length(%s, %s)''' % (var, var)
-        elif filterName == "startswith":
-            var = "suit.SuitFilters.startswith(%s, %s)" % (var, data)
-        elif filterName == "in":
-            var = "suit.SuitFilters.inArray(%s, %s)" % (var, data)
-        elif filterName == "notin":
-            var = "!suit.SuitFilters.inArray(%s, %s)" % (var, data)
-        elif filterName == "contains":
-            var = "suit.SuitFilters.contains(%s, %s)" % (var, data)
-        elif filterName == "bool":
-            return "suit.SuitFilters.to_bool(%s)" % var
-        elif filterName == "int":
-            return "suit.SuitFilters.str2int(%s)" % var
-        elif filterName == "str":
-            return '''suit.SuitFilters.to_str(%s)''' % var
-        elif filterName == "dateformat":
-            return '''suit.SuitFilters.dateformat(%s, %s)''' % (var, data)
-        elif filterName == "usebr":
-            return '''suit.SuitFilters.usebr(%s)''' % var
-        elif filterName == "plural_form":
-            return '''suit.SuitFilters.plural_form(%s, %s)''' % (var, data)
-        elif filterName == "html":
-            return '''suit.SuitFilters.html(%s)''' % var
-        var = "suit.SuitRunTime.stringify(%s)" % var
-        return var
+        suit_filter = SuitFilters.registry.get(filterName)
+        if suit_filter is None:
+            return "suit.SuitRunTime.stringify(%s)" % var
+        if suit_filter.javascript is None:
+            return "suit.SuitFilters.%s(%s)" % (filterName, var if data is None else "%s, %s" % (var, data))
+        return suit_filter.javascript.format(var=var, data=data)
 
 
 class Compiler(object):
+    def __init__(self, languages=None):
+        """
+        :param languages:   map of the target languages to the syntax engines,
+                            PythonSyntax can be used for "py" to get the templates compiled into single expressions
+                            and PythonProfileSyntax to get them reporting to SuitProfiler
+        """
+        self.languages = languages or {"py": PythonRenderSyntax, "js": JavascriptSyntax}
+
     def compile(self, path="."):
         """
         Компилирует все найденные шаблоны внутри указанного каталога
@@ -827,15 +1749,35 @@ class Compiler(object):
         :param path:    Путь до каталога с шаблонами
         """
         self._checkCompiledPackage()
+        self._compile(path)
+        # собранный ранее файл содержит прежние версии шаблонов
+        if os.path.isfile("__py__/%s" % TemplatesRegistry.bundle_name):
+            self.bundle()
+
+    def _compile(self, path):
         for file in os.listdir(path):
             target = (path + "/" + file) if path != "." else file
             if os.path.isdir(target):
-                self.compile(target)
+                self._compile(target)
             elif os.path.isfile(target):
                 if self._isTemplateName(target) is False:
                     continue
                 template = Template(target)
-                template.compile({"py": PythonSyntax, "js": JavascriptSyntax})
+                template.compile(self.languages)
+
+    def bundle(self):
+        """
+        Собирает скомпилированные python-шаблоны каталога __py__ в единый файл с их байт-кодом (marshal),
+        из которого TemplatesRegistry загружает все шаблоны одним чтением вместо импорта модуля каждого шаблона
+        Собранный файл пересобирается при каждой компиляции, иначе из него загружались бы прежние версии шаблонов
+        """
+        code = {}
+        for file in sorted(os.listdir("__py__")):
+            if file.endswith(".py") and file != "__init__.py":
+                with open("__py__/%s" % file) as f:
+                    code[file[:-3]] = compile(f.read(), os.path.abspath("__py__/%s" % file), "exec")
+        with open("__py__/%s" % TemplatesRegistry.bundle_name, "wb") as f:
+            f.write(TemplatesRegistry.bundle_header() + marshal.dumps(code))
 
     def build(self):
         """
@@ -942,30 +1884,318 @@ class Compiler(object):
 # ########################################## RunTime Classes ##########################################################
 
 
+class TemplatesRegistry(object):
+    """
+    Process-wide map of dotted template names (views.subfolder.template) to the compiled template classes
+    """
+
+    # file of the __py__ package with the code of all its compiled templates (see Compiler.bundle())
+    bundle_name = "all.bundle"
+
+    def __init__(self):
+        self.classes = {}
+        self.instances = {}
+        self.bundles = {}
+
+    @staticmethod
+    def bundle_header():
+        """ Header of the bundle: format version and magic number of the python version which code it contains """
+        return b"SUITBUNDLE1" + importlib.util.MAGIC_NUMBER
+
+    def bundle(self, cpath):
+        """
+        Reads the bundle of the __py__ package at once and remembers it
+        :param cpath:   path of the __py__ package
+        :return:        dict of the code objects by the names of the modules, empty if there is no valid bundle
+        """
+        bundle = self.bundles.get(cpath)
+        if bundle is None:
+            try:
+                with open(cpath + self.bundle_name, "rb") as f:
+                    content = f.read()
+            except OSError:
+                content = b""
+            header = self.bundle_header()
+            try:
+                bundle = marshal.loads(content[len(header):]) if content.startswith(header) else {}
+            except (ValueError, EOFError, TypeError):
+                # corrupt bundle, the templates are imported from their own modules
+                bundle = {}
+            self.bundles[cpath] = bundle
+        return bundle
+
+    def load(self, cpath, module_name):
+        """
+        Imports the module of the compiled template from the bundle of the __py__ package or from its own file
+        :param cpath:       path of the __py__ package
+        :param module_name: name of the module in the package
+        :return:            module
+        """
+        full_name = "%s%s" % (cpath.replace("/", "."), module_name)
+        code = self.bundle(cpath).get(module_name)
+        if code is not None and full_name not in sys.modules:
+            importlib.import_module(cpath.replace("/", ".").rstrip("."))
+            module = types.ModuleType(full_name)
+            module.__file__ = code.co_filename
+            exec(code, module.__dict__)
+            sys.modules[full_name] = module
+        return importlib.import_module(full_name)
+
+    def get(self, name):
+        """
+        Returns compiled template class by it's dotted name, resolves and remembers it on the first call
+        :param name:    dotted template name
+        :return:        compiled template class
+        """
+        template_class = self.classes.get(name)
+        if template_class is None:
+            template_class = self.classes[name] = self.resolve(name)
+        return template_class
+
+    def instance(self, name):
+        """
+        Returns the instance of compiled template shared by all the threads: the data is passed to the render function
+        on every call, so templates keep no state between the executions
+        :param name:    dotted template name
+        :return:        compiled template
+        """
+        template = self.instances.get(name)
+        if template is None:
+            template_class = self.get(name)
+            if not hasattr(template_class, "render"):
+                # templates compiled by the previous versions keep the data in the instance
+                return template_class()
+            template = self.instances[name] = template_class()
+        return template
+
+    def resolve(self, name):
+        """
+        Looks for the compiled template module on the filesystem and imports it
+        The shortest path prefix containing a __py__ package wins
+        :param name:    dotted template name
+        :return:        compiled template class
+        """
+        path = name.split(".")
+        for i in reversed(range(len(path))):
+            cpath = "%s/__py__/" % "/".join(path[:len(path) - i])
+            if os.path.isdir(cpath):
+                template_name_part = "_".join(path[len(path) - i:])
+                return getattr(self.load(cpath, template_name_part), template_name_part)
+        raise TemplateNotFound("template not found")
+
+    def preload(self, root="views"):
+        """
+        Imports all the compiled templates under the root directory and remembers the ones having the sources
+        :param root:    directory with the templates, relative to the current directory as the dotted names are
+        :return:        tuple of the number of imported modules and the dotted names of the remembered templates
+        """
+        modules, names = 0, []
+        for directory, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("__"))
+            package = directory.replace(os.sep, ".").strip(".")
+            cpath = "%s/__py__/" % package.replace(".", "/")
+            if os.path.isdir(cpath):
+                module_names = list(self.bundle(cpath)) or [
+                    file[:-3] for file in sorted(os.listdir(cpath)) if file.endswith(".py") and file != "__init__.py"
+                ]
+                for module_name in module_names:
+                    self.load(cpath, module_name)
+                    modules += 1
+            for file in sorted(files):
+                if file.endswith(".html"):
+                    name = "%s.%s" % (package, file[:-5])
+                    try:
+                        self.get(name)
+                    except (TemplateNotFound, ImportError, AttributeError):
+                        continue
+                    names.append(name)
+        return modules, names
+
+    def invalidate(self, name=None):
+        """
+        Forgets resolved template (or all of them if name is not given), so recompiled sources would be picked up
+        :param name:    dotted template name
+        """
+        names = [name] if name is not None else list(self.classes)
+        for template_name in names:
+            self.instances.pop(template_name, None)
+            template_class = self.classes.pop(template_name, None)
+            if template_class is not None:
+                sys.modules.pop(template_class.__module__, None)
+        # bundles are read again, they may be rebuilt as well
+        self.bundles.clear()
+
+
+class InlineTemplatesCache(object):
+    """
+    Bounded LRU cache of the compiled inline templates ("{...}" strings), keyed by their source text
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, source):
+        """
+        Returns compiled inline template, compiles and remembers it on miss
+        :param source:  source text of the inline template
+        :return:        function that executes template with a given context
+        """
+        with self.lock:
+            template = self.templates.get(source)
+            if template is not None:
+                self.hits += 1
+                self.templates.move_to_end(source)
+                return template
+            self.misses += 1
+        template = self.compile(source)
+        with self.lock:
+            self.templates[source] = template
+            while len(self.templates) > self.size:
+                self.templates.popitem(last=False)
+        return template
+
+    @staticmethod
+    def compile(source):
+        """ Compiles inline template source into python function """
+        engine = PythonSyntax()
+        engine.cache_namespace = source
+        compiled = engine.compile(TemplatePart(source).getDataForCompile())
+        compiled = re.sub('\\bitervar_(\\w+)', lambda m: 'ctx["itervar_%s"]' % m.group(1), compiled)
+        module = {"Suit": Suit, "SuitRunTime": SuitRunTime, "SuitNone": SuitNone, "SuitFilters": SuitFilters}
+        exec(compile("%s\ntemplate = lambda ctx: %s" % (engine.accessors_source(), compiled),
+                     "<suit inline template>", "exec"), module)
+        return module["template"]
+
+    def clear(self):
+        """ Drops all compiled templates and resets statistics """
+        with self.lock:
+            self.templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class FragmentsCache(object):
+    """
+    Bounded LRU cache of the rendered fragments (<cache key="..." ttl="..."> tags), keyed by the scopes of the tags
+    (the name of the template and the ordinal of the tag in it) and their rendered keys
+    Fragments expire after their ttl and are evicted when there are more than size of them
+    or their total length exceeds max_chars
+    """
+
+    def __init__(self, size=1024, max_chars=32 * 1024 * 1024):
+        self.size = size
+        self.max_chars = max_chars
+        # key -> (fragment, expiration time or None)
+        self.fragments = OrderedDict()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Returns the fragment cached under the key
+        :param key:     rendered key of the fragment
+        :return:        str or None if there is no such fragment or it has expired
+        """
+        with self.lock:
+            entry = self.fragments.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] > monotonic():
+                    self.hits += 1
+                    self.fragments.move_to_end(key)
+                    return entry[0]
+                del self.fragments[key]
+                self.chars -= len(entry[0])
+                self.expirations += 1
+            self.misses += 1
+        return None
+
+    def set(self, key, fragment, ttl=None):
+        """
+        Caches the fragment, evicting the least recently used ones beyond the limits
+        :param key:         rendered key of the fragment
+        :param fragment:    rendered fragment
+        :param ttl:         seconds the fragment is kept for (None to keep it until it is evicted)
+        :return:            the fragment
+        """
+        if (ttl is not None and ttl <= 0) or len(fragment) > self.max_chars:
+            return fragment
+        expiration = monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            previous = self.fragments.pop(key, None)
+            if previous is not None:
+                self.chars -= len(previous[0])
+            self.fragments[key] = (fragment, expiration)
+            self.chars += len(fragment)
+            while len(self.fragments) > self.size or self.chars > self.max_chars:
+                evicted, _ = self.fragments.popitem(last=False)[1]
+                self.chars -= len(evicted)
+                self.evictions += 1
+        return fragment
+
+    def fragment(self, key, ttl, render):
+        """ Returns the fragment cached under the key, renders and caches it on miss """
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = self.set(key, render(), ttl)
+        return fragment
+
+    def invalidate(self, key, template=None):
+        """
+        Drops the fragments cached under the rendered key, so they are rendered again on the next execution
+        :param key:         rendered key of the fragments
+        :param template:    dotted name of the template (as in includes) to drop its fragments only
+        """
+        with self.lock:
+            for cached in [
+                cached for cached in self.fragments if cached == key or (
+                    cached.__class__ is tuple and cached[1] == key and
+                    (template is None or cached[0].rsplit(":", 1)[0] == template)
+                )
+            ]:
+                self.chars -= len(self.fragments.pop(cached)[0])
+
+    def stats(self):
+        """ Returns the number and the total length of the cached fragments and the counters of the cache """
+        with self.lock:
+            return OrderedDict([
+                ("fragments", len(self.fragments)), ("chars", self.chars), ("hits", self.hits), ("misses", self.misses),
+                ("expirations", self.expirations), ("evictions", self.evictions)
+            ])
+
+    def clear(self):
+        """ Drops all fragments and resets statistics """
+        with self.lock:
+            self.fragments.clear()
+            self.chars = 0
+            self.hits = 0
+            self.misses = 0
+            self.expirations = 0
+            self.evictions = 0
+
+
 class Suit(object):
     """
     Suit execution wrapper
     """
 
+    registry = TemplatesRegistry()
+    inline_templates = InlineTemplatesCache()
+    fragments = FragmentsCache()
+
     def __init__(self, path):
+        self.path = path
         if not path.startswith("{"):
-            path = path.split(".")
-            self.template = None
-            for i in range(len(path)):
-                cpath = "%s/__py__/" % "/".join(path[:len(path) - i])
-                if os.path.isdir(cpath):
-                    template_name_part = "_".join(path[len(path) - i:])
-                    module = importlib.import_module("%s%s" % (cpath.replace("/", "."), template_name_part))
-                    template_class = getattr(module, template_name_part)
-                    self.template = template_class()
-            if not self.template:
-                raise TemplateNotFound("template not found")
+            self.template = self.registry.instance(path)
         else:
-            template_part = TemplatePart(path)
-            compiled = PythonSyntax().compile(template_part.getDataForCompile())
-            self.template = "lambda self: %s" % compiled
-            self.template = re.sub('\[itervar_(.+?)\]', lambda m: '[self.data["itervar_%s"]]' % m.group(1),
-                                   self.template)
+            self.template = self.inline_templates.get(path)
 
     def execute(self, data=None):
         """
@@ -977,36 +2207,156 @@ class Suit(object):
             data = {}
         if hasattr(self.template, "execute"):
             res = self.template.execute(data)
-            # поддержка internal.data, suit.environment и auto-refresh на стороне клиента:
-            if res.startswith("<!DOCTYPE html>") and res.find("auto-refresh") > -1:
-                exclude = data.get("suit_environment_exclude")
-                if exclude:
-                    suit_env_data = {key: val for key, val in data.items() if key not in exclude}
-                else:
-                    suit_env_data = data
-                res = res.replace("</head>",
-                                  '''<script id="suit_environment_script">window.suit_environment='%s'</script></head>''' % json_safedumps(
-                                      suit_env_data))
+            # поддержка internal.data, suit.environment и auto-refresh на стороне клиента
+            # для шаблонов, в которые место вставки suit_environment не было скомпилировано:
+            if getattr(self.template, "environment", None) is None and self.uses_environment(res):
+                res = self.environment(res, data, getattr(self.template, "environment_keys", None))
             return res
         else:
-            # noinspection PyAttributeOutsideInit
-            self.data = data
-            return eval(self.template)(self)
+            return self.template(data)
+
+    async def execute_async(self, data=None):
+        """
+        Executes a template with the data which values may be awaitable (coroutines, tasks, futures)
+        Only the values used by the template are awaited, values used by sibling includes are awaited concurrently.
+        Coroutines that were not used are closed.
+        :param data: data for template execution
+        :return:     result of template execution
+        """
+        ctx = SuitRunTime.pending(data or {})
+        try:
+            if hasattr(self.template, "execute_async"):
+                res = await self.template.execute_async(ctx)
+                if getattr(self.template, "environment", None) is None and self.uses_environment(res):
+                    await SuitRunTime.resolve(ctx, tuple(ctx))
+                    res = self.environment(res, ctx, getattr(self.template, "environment_keys", None))
+                return res
+            else:
+                await SuitRunTime.resolve(ctx, tuple(ctx))
+                return self.execute(ctx)
+        finally:
+            for value in ctx.values():
+                if isinstance(value, SuitPending):
+                    value.close()
+
+    @staticmethod
+    def preload(root="views", sample=None, freeze=True):
+        """
+        Prepares the templates before the workers of prefork server are forked (gunicorn with preload_app):
+        imports all the compiled templates, warms them up by rendering with the sample data
+        and moves all the objects into the permanent generation of gc, so the memory stays shared after fork
+        :param root:    directory with the templates
+        :param sample:  data every template is rendered with or function(name) returning it, no warm-up if None
+        :param freeze:  whether gc.freeze() is called
+        :return: dict:  report: numbers of the modules and templates, seconds spent by every stage, warm-up errors
+        """
+        report = OrderedDict([("modules", 0), ("templates", 0), ("import", 0.0), ("warmup", 0.0), ("freeze", 0.0),
+                              ("total", 0.0), ("errors", OrderedDict())])
+        started = perf_counter()
+        report["modules"], names = Suit.registry.preload(root)
+        report["templates"] = len(names)
+        report["import"] = perf_counter() - started
+        if sample is not None:
+            stage = perf_counter()
+            for name in names:
+                try:
+                    Suit(name).execute(sample(name) if callable(sample) else sample)
+                except Exception as e:
+                    report["errors"][name] = "%s: %s" % (e.__class__.__name__, e)
+            report["warmup"] = perf_counter() - stage
+        if freeze and hasattr(gc, "freeze"):
+            stage = perf_counter()
+            gc.collect()
+            gc.freeze()
+            report["freeze"] = perf_counter() - stage
+        report["total"] = perf_counter() - started
+        return report
+
+    def execute_many(self, data_iterable, processes=None, ordered=True, chunksize=64):
+        """
+        Executes the template for every data of the iterable (mass mailing, documents generation)
+        The template is resolved once, the work can be spread across the pool of processes
+        :param data_iterable:   iterable of the data for template execution (picklable when processes are used)
+        :param processes:       number of worker processes, the template is executed in the current process by default
+        :param ordered:         whether the results follow the order of the data, otherwise they are yielded
+                                as soon as they are ready (makes sense with processes only)
+        :param chunksize:       number of the data sent to a worker process at once
+        :return:                generator of the results
+        """
+        if processes:
+            from multiprocessing import Pool
+            with Pool(processes, initializer=_batch_init, initargs=(self.path,)) as pool:
+                results = pool.imap(_batch_execute, data_iterable, chunksize) if ordered else \
+                    pool.imap_unordered(_batch_execute, data_iterable, chunksize)
+                yield from results
+            return
+        template = self.template
+        # templates with suit_environment decided at compile time need no checks of the result
+        if hasattr(template, "execute") and getattr(template, "environment", None) is not None:
+            execute = template.execute
+        else:
+            execute = self.execute
+        for data in data_iterable:
+            yield execute(data if data is not None else {})
+
+    @staticmethod
+    def uses_environment(res):
+        """ Checks whether the page needs suit_environment (internal.data, suit.environment and auto-refresh) """
+        return res.startswith("<!DOCTYPE html>") and res.find("auto-refresh") > -1
+
+    @staticmethod
+    def environment(res, data, keys=None):
+        """ Injects the template's data (or its given keys only) into the page as suit_environment """
+        return res.replace("</head>", SuitRunTime.environment(data, keys) + "</head>")
+
+    def execute_iter(self, data=None, encoding=None):
+        """
+        Executes a template and yields the result by chunks as soon as they are ready
+        Templates compiled into single expression (PythonSyntax) and inline templates yield one chunk.
+        Result can be returned as WSGI response body if encoding is given.
+        Note: the pages which get suit_environment depending on the result are executed as a whole (one chunk)
+        :param data:        data for template execution
+        :param encoding:    if given, chunks are encoded into bytes
+        :return:            generator of the result chunks
+        """
+        if data is None:
+            data = {}
+        # suit_environment decided at runtime depends on the whole page, so such pages can't be streamed
+        if hasattr(self.template, "execute_iter") and getattr(self.template, "environment", None) is not None:
+            chunks = self.template.execute_iter(data)
+        else:
+            chunks = [self.execute(data)]
+        for chunk in chunks:
+            yield chunk.encode(encoding) if encoding else chunk
 
 
 def suit(templateName):
     """ Suit decorator """
 
     def decorator(func):
+        suit_template = None
+
+        def template():
+            """ Resolves the template once, again only if it was invalidated in the registry """
+            nonlocal suit_template
+            if suit_template is None or templateName not in Suit.registry.classes:
+                suit_template = Suit(templateName)
+            return suit_template
+
+        try:
+            template()
+        except (TemplateNotFound, ImportError):
+            pass  # template is not compiled yet (or its module is absent in __py__), it is resolved on the first call
+
         def wrapped(*args, **kwargs):
             data = func(*args, **kwargs)
             if isinstance(data, str) and len(data) > 0:
                 return data
             elif isinstance(data, dict) is True:
-                return Suit(templateName).execute(data)
+                return template().execute(data)
             else:
                 try:
-                    return Suit(templateName).execute()
+                    return template().execute()
                 except KeyError:
                     return data
                 except NameError:
@@ -1020,10 +2370,29 @@ def suit(templateName):
 class SuitRunTime(object):
     """ RunTime helpers """
 
+    # JSON backend used for printing of lists and dicts, suit_environment and include's data
+    json_backend = None
+
     @staticmethod
     def stringify(obj):
         """ Prints variable """
-        return json.dumps(obj, default=json_dumps_handler) if isinstance(obj, (list, dict)) else obj
+        return SuitRunTime.json_backend.dumps(obj) if isinstance(obj, (list, dict)) else obj
+
+    # exceptions meaning that variable is missing in the template's data
+    lookup_errors = (KeyError, IndexError, TypeError, NameError)
+
+    # number of chunks accumulated by streaming render before they are yielded
+    stream_buffer = 256
+
+    @staticmethod
+    def text(obj):
+        """ Returns textual representation of the variable's value """
+        return SuitRunTime.json_backend.dumps(obj) if isinstance(obj, (list, dict)) else str(obj)
+
+    @staticmethod
+    def value(res):
+        """ Returns variable's value that is safe to be printed """
+        return escape(res, quote=True) if isinstance(res, str) else res
 
     @staticmethod
     def var(lambdavar, default, context):
@@ -1052,6 +2421,35 @@ class SuitRunTime(object):
         except TypeError:
             return safedefault()
 
+    @staticmethod
+    def literal(value):
+        """
+        Returns the value of a variable as it is seen by compiled conditions and expressions:
+        strings are read as python literals when possible ("3" -> 3, "True" -> True, '"a"' -> "a"),
+        any other values are returned as is
+        :param value:   variable's value
+        :return:        value to be used in python expression
+        """
+        return _read_literal(value) if isinstance(value, str) else value
+
+    @staticmethod
+    def item(obj, key):
+        """
+        Returns the item of the container or None if it is missing
+        Used by the accessors of compiled templates when the container is neither dict nor list
+        """
+        if obj is None:
+            return None
+        cls = obj.__class__
+        if cls is ChainMap or cls is OrderedDict:
+            return obj.get(key)
+        if (cls is list or cls is tuple) and key.__class__ is int:
+            return obj[key] if -len(obj) <= key < len(obj) else None
+        try:
+            return obj[key]
+        except SuitRunTime.lookup_errors:
+            return None
+
     @staticmethod
     def opt(condition, true, false):
         """
@@ -1071,8 +2469,31 @@ class SuitRunTime(object):
         :param iterable:            iterable object
         :return: str:               result of cycle
         """
-        iterable = range(0, len(iterable)) if isinstance(iterable, list) else iterable
-        return "".join([iterationGenerator(itervar) for itervar in iterable])
+        return "".join([iterationGenerator(itervar) for itervar in SuitRunTime.iterate(iterable)])
+
+    @staticmethod
+    def each(iterationGenerator, iterable):
+        """
+        Returns the result of an iteration
+        :param iterationGenerator:  lambda function that generates template for the key and the item on each iteration
+        :param iterable:            iterable object
+        :return: str:               result of cycle
+        """
+        return "".join([iterationGenerator(key, item) for key, item in SuitRunTime.enumerate(iterable)])
+
+    @staticmethod
+    def iterate(iterable):
+        """ Returns values of the iteration variable: indexes of the list or keys of the dict """
+        return range(0, len(iterable)) if isinstance(iterable, list) else iterable
+
+    @staticmethod
+    def enumerate(iterable):
+        """ Returns pairs of the iteration variable and the item: indexes and items of lists, keys and values of dicts """
+        if isinstance(iterable, list):
+            return enumerate(iterable)
+        if isinstance(iterable, dict):
+            return iterable.items()
+        return ((key, SuitRunTime.item(iterable, key)) for key in iterable)
 
     @staticmethod
     def expression(expression):
@@ -1084,31 +2505,231 @@ class SuitRunTime(object):
         return eval(expression)
 
     @staticmethod
-    def include(iter_dict, template_name, main_data, datatemplate_part_to_become_data):
-        from copy import deepcopy
-        from collections import OrderedDict
+    def include(iter_dict, template_name, main_data, datatemplate_part_to_become_data, keys=None):
+        """
+        Executes included template with the data of the current one extended by the include's own data
+        :param iter_dict:                           iteration variables of the enclosing lists
+        :param template_name:                       name of the included template
+        :param main_data:                           lambda function that returns data of the current template
+        :param datatemplate_part_to_become_data:    lambda function that returns include's data
+                                                    (or inline template which renders it into json)
+        :param keys:                                keys of the template's data used by include's data
+        :return: str:                               result of the included template execution
+        """
+        return Suit("views.%s" % template_name).execute(
+            SuitRunTime.include_data(iter_dict, main_data, datatemplate_part_to_become_data)
+        )
+
+    @staticmethod
+    def include_iter(iter_dict, template_name, main_data, datatemplate_part_to_become_data, keys=None):
+        """ Same as include(), but yields the result of the included template execution by chunks """
+        return Suit("views.%s" % template_name).execute_iter(
+            SuitRunTime.include_data(iter_dict, main_data, datatemplate_part_to_become_data)
+        )
+
+    @staticmethod
+    def environment(data, keys=None):
+        """
+        Returns the script which passes the template's data to the client side as suit_environment
+        :param data:    template's data
+        :param keys:    variables used by the templates of the page (None to pass the whole data)
+        """
+        exclude = data.get("suit_environment_exclude") or ()
+        if keys is not None:
+            suit_env_data = {key: data[key] for key in keys if key in data and key not in exclude}
+        elif exclude:
+            suit_env_data = {key: val for key, val in data.items() if key not in exclude}
+        else:
+            suit_env_data = data if isinstance(data, dict) else dict(data)
+        return '''<script id="suit_environment_script">window.suit_environment='%s'</script>''' % json_safedumps(
+            suit_env_data)
+
+    @staticmethod
+    def include_async(iter_dict, template_name, main_data, datatemplate_part_to_become_data, keys=None):
+        """
+        Same as include(), but returns the task which executes included template asynchronously
+        Tasks of the sibling includes are awaited together by SuitRunTime.join_async()
+        """
+        async def execute():
+            await SuitRunTime.resolve(
+                main_data(), keys if keys is not None else _data_keys(datatemplate_part_to_become_data)
+            )
+            template = Suit("views.%s" % template_name).template
+            data = SuitRunTime.include_data(iter_dict, main_data, datatemplate_part_to_become_data)
+            if hasattr(template, "execute_async"):
+                return await template.execute_async(data)
+            await SuitRunTime.resolve(data, tuple(data))
+            return template.execute(data)
+
+        return asyncio.ensure_future(execute())
+
+    @staticmethod
+    def pending(data):
+        """ Returns a copy of the template's data where awaitable values are wrapped into SuitPending """
+        return {key: SuitPending(value) if isawaitable(value) else value for key, value in data.items()}
+
+    @staticmethod
+    async def resolve(ctx, keys):
+        """
+        Awaits pending values of the given keys of the template's data and replaces them with the results
+        :param ctx:     template's data
+        :param keys:    keys used by the statement to be executed
+        """
+        pending = [key for key in keys if isinstance(ctx.get(key), SuitPending)]
+        if pending:
+            results = await asyncio.gather(*[ctx[key].result() for key in pending])
+            for key, result in zip(pending, results):
+                ctx[key] = result
+
+    @staticmethod
+    def cancel(chunks):
+        """
+        Cancels the tasks of included templates left pending when render_async fails,
+        exceptions of the finished ones are retrieved, so they are not reported as never retrieved
+        """
+        for chunk in chunks:
+            if isinstance(chunk, asyncio.Future):
+                if not chunk.done():
+                    chunk.cancel()
+                elif not chunk.cancelled():
+                    chunk.exception()
+
+    @staticmethod
+    async def join_async(chunks):
+        """ Joins the result of render_async, awaiting the tasks of included templates """
+        tasks = [chunk for chunk in chunks if not isinstance(chunk, str)]
+        if tasks:
+            results = iter(await asyncio.gather(*tasks))
+            chunks = [chunk if isinstance(chunk, str) else next(results) for chunk in chunks]
+        return "".join(chunks)
+
+    @staticmethod
+    def cache(key, ttl, render):
+        """
+        Returns the fragment of <cache> tag from Suit.fragments, renders and caches it on miss
+        :param key:     scope of the tag and rendered key of the fragment
+        :param ttl:     seconds the fragment is kept for (None to keep it until it is evicted)
+        :param render:  function rendering the fragment
+        """
+        return Suit.fragments.fragment(key, ttl, render)
+
+    @staticmethod
+    def scope_value(value):
+        """
+        Returns the value placed into include's data outside of the string literals
+        Textual values are parsed as json, as they were rendered into the data block
+        """
+        if isinstance(value, str):
+            try:
+                return SuitRunTime.json_backend.loads(value)
+            except ValueError:
+                return value
+        return None if isinstance(value, SuitNone) else value
 
+    @staticmethod
+    def include_data(iter_dict, main_data, datatemplate_part_to_become_data):
+        """
+        Returns the data for included template
+        The data of the current template is shared read-only, only the include's own keys are stored separately
+        """
         main_data = main_data()
-        new_data = deepcopy(main_data)
+        new_data = main_data.new_child() if isinstance(main_data, ChainMap) else ChainMap({}, main_data)
+        if callable(datatemplate_part_to_become_data):
+            new_data.update(datatemplate_part_to_become_data())
+            return new_data
+        # templates compiled by the previous versions pass the data block to be rendered and parsed
         for key in iter_dict:
             new_data["itervar_%s" % key] = iter_dict[key]
             datatemplate_part_to_become_data = datatemplate_part_to_become_data.replace('[%s]' % key,
                                                                                         '[itervar_%s]' % key)
+        scope_json = Suit(datatemplate_part_to_become_data).execute(new_data)
         try:
-            scope_data = json.loads(Suit(datatemplate_part_to_become_data).execute(new_data),
-                                    object_pairs_hook=OrderedDict)
+            scope_data = SuitRunTime.json_backend.loads(scope_json)
             new_data.update(scope_data)
         except ValueError:
-            print("!!! ERROR !!! INVALID JSON: %s" % Suit(datatemplate_part_to_become_data).execute(new_data))
-        return Suit("views.%s" % template_name).execute(new_data)
+            print("!!! ERROR !!! INVALID JSON: %s" % scope_json)
+        return new_data
+
+
+class SuitFilter(object):
+    """
+    Filter registered in SuitFilters
+    :param name:        name of the filter used in templates: <var filter="name" name-data="...">
+    :param function:    python function(var[, data])
+    :param pure:        whether the result depends on the arguments only
+    :param javascript:  javascript expression with {var} and {data} placeholders,
+                        suit.SuitFilters.<name>(var[, data]) by default
+    :param memoize:     whether the results are memoized during the render, pure filters are memoized by default
+    """
+
+    __slots__ = ("name", "function", "pure", "javascript", "memoize")
+
+    def __init__(self, name, function, pure=False, javascript=None, memoize=None):
+        self.name = name
+        self.function = function
+        self.pure = pure
+        self.javascript = javascript
+        self.memoize = pure if memoize is None else memoize and pure
+
+
+class SuitFilterRegistry(dict):
+    """ Registered filters by their names, filters defined as SuitFilters._<name> are still found """
+
+    def __missing__(self, name):
+        function = getattr(SuitFilters, "_%s" % name, None)
+        if function is None:
+            raise AttributeError("unknown filter: %s" % name)
+        # stored on the first miss, so the filter isn't wrapped again on every call
+        self[name] = SuitFilter(name, function)
+        return self[name]
 
 
 class SuitFilters(object):
     """
     Базовый класс, предоставляющий функционал фильтров (декораторов) для применения к переменным
+    Фильтры хранятся в реестре registry, проекты добавляют свои фильтры через SuitFilters.register()
 
     """
 
+    # registered filters by their names
+    registry = SuitFilterRegistry()
+
+    @staticmethod
+    def register(name, function=None, pure=False, javascript=None, memoize=None):
+        """
+        Registers the filter (see SuitFilter for the arguments), can be used as a decorator:
+            @SuitFilters.register("money", pure=True)
+            def money(var): ...
+        Filters must be registered before the templates which use them are compiled,
+        otherwise they are compiled as impure ones
+        """
+        if function is None:
+            return lambda function: SuitFilters.register(name, function, pure, javascript, memoize)
+        SuitFilters.registry[name] = SuitFilter(name, function, pure, javascript, memoize)
+        return function
+
+    @staticmethod
+    def memoized(name):
+        """ Checks whether the results of the filter are memoized during the render """
+        suit_filter = SuitFilters.registry.get(name)
+        return suit_filter is not None and suit_filter.memoize
+
+    @staticmethod
+    def cached(memo, name, var, *data):
+        """
+        Applies the pure filter, its results are memoized by the arguments in the memo dict of the current render
+        Unhashable arguments are not memoized
+        """
+        # class of the value is a part of the key, as 1 and True are equal, but give different results
+        key = (name, var.__class__, var) + data
+        try:
+            return memo[key]
+        except KeyError:
+            result = memo[key] = SuitFilters.registry[name].function(var, *data)
+            return result
+        except TypeError:
+            return SuitFilters.registry[name].function(var, *data)
+
     @staticmethod
     def _length(var):
         return len(str(var) if isinstance(var, (int, float)) is True else var) if var not in [None, ""] else 0
@@ -1126,6 +2747,12 @@ class SuitFilters(object):
                 data = json.loads(data)
             except:
                 data = data or []
+        if data.__class__ is frozenset:
+            # literal data folded by the compiler: unhashable values are never equal to its items
+            try:
+                return var in data
+            except TypeError:
+                return False
         if not isinstance(data, (dict, list, tuple)):
             return False
         return (var in data) if (isinstance(var, SuitNone) is False and isinstance(data, SuitNone) is False) else False
@@ -1175,7 +2802,7 @@ class SuitFilters(object):
     @staticmethod
     def _plural_form(initial_num, words):
         initial_num = initial_num if initial_num else 0
-        if words:
+        if words and isinstance(words, str):
             words = json.loads(words)
         num = int(initial_num) % 100
         if num > 19:
@@ -1189,11 +2816,177 @@ class SuitFilters(object):
         return "%d %s" % (initial_num, word)
 
 
+# cheap filters are not memoized: the lookup would cost more than the filter itself
+SuitFilters.register("length", SuitFilters._length, pure=True,
+                     javascript="suit.SuitRunTime.stringify(suit.SuitFilters.get_length({var}, {var}))")
+SuitFilters.register("startswith", SuitFilters._startswith, pure=True, memoize=False,
+                     javascript="suit.SuitRunTime.stringify(suit.SuitFilters.startswith({var}, {data}))")
+SuitFilters.register("in", SuitFilters._in, pure=True, memoize=False,
+                     javascript="suit.SuitRunTime.stringify(suit.SuitFilters.inArray({var}, {data}))")
+SuitFilters.register("notin", SuitFilters._notin, pure=True, memoize=False,
+                     javascript="suit.SuitRunTime.stringify(!suit.SuitFilters.inArray({var}, {data}))")
+SuitFilters.register("contains", SuitFilters._contains, pure=True, memoize=False,
+                     javascript="suit.SuitRunTime.stringify(suit.SuitFilters.contains({var}, {data}))")
+SuitFilters.register("bool", SuitFilters._bool, pure=True, memoize=False, javascript="suit.SuitFilters.to_bool({var})")
+SuitFilters.register("int", SuitFilters._int, pure=True, memoize=False, javascript="suit.SuitFilters.str2int({var})")
+SuitFilters.register("str", SuitFilters._str, pure=True, memoize=False, javascript="suit.SuitFilters.to_str({var})")
+SuitFilters.register("dateformat", SuitFilters._dateformat, pure=True)
+SuitFilters.register("usebr", SuitFilters._usebr, pure=True, memoize=False)
+SuitFilters.register("html", SuitFilters._html, pure=True, memoize=False)
+SuitFilters.register("plural_form", SuitFilters._plural_form, pure=True)
+
+
+class SuitProfiler(object):
+    """
+    Collects the time and the number of calls of the tags of templates compiled with PythonProfileSyntax
+    Every record is kept under the path of the sites it was made at: the template, the enclosing tags and includes,
+    so the time can be reported per tag (report) or as collapsed stacks for the flamegraph tools (dump)
+    """
+
+    # path of the sites -> [calls, total time in seconds]
+    stats = {}
+    # path of the include being executed, the included template records its tags under it
+    path = ContextVar("suit_profiler_path", default=())
+    clock = staticmethod(perf_counter)
+    lock = Lock()
+
+    @staticmethod
+    def record(path, start):
+        """
+        Records the execution of the site
+        :param path:    tuple of the sites from the root template to the executed one
+        :param start:   SuitProfiler.clock() value taken before the execution
+        """
+        elapsed = perf_counter() - start
+        with SuitProfiler.lock:
+            stat = SuitProfiler.stats.get(path)
+            if stat is None:
+                SuitProfiler.stats[path] = [1, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+
+    @staticmethod
+    def reset():
+        """ Forgets all the records """
+        with SuitProfiler.lock:
+            SuitProfiler.stats.clear()
+
+    @staticmethod
+    def paths():
+        """
+        Returns the records with the own time of the sites, which excludes the time of the nested profiled sites
+        :return: dict:  {path: (calls, total, own)}
+        """
+        with SuitProfiler.lock:
+            stats = {path: tuple(stat) for path, stat in SuitProfiler.stats.items()}
+        nested = {}
+        for path, (calls, total) in stats.items():
+            if len(path) > 1:
+                nested[path[:-1]] = nested.get(path[:-1], 0) + total
+        return {path: (calls, total, max(total - nested.get(path, 0), 0)) for path, (calls, total) in stats.items()}
+
+    @staticmethod
+    def table():
+        """
+        Returns the records aggregated per site, the total time of the recursive includes is counted once
+        :return: list:  [(site, calls, total, own)] sorted by the own time
+        """
+        sites = {}
+        for path, (calls, total, own) in SuitProfiler.paths().items():
+            row = sites.setdefault(path[-1], [0, 0.0, 0.0])
+            row[0] += calls
+            row[2] += own
+            if path[-1] not in path[:-1]:
+                row[1] += total
+        return sorted(((site,) + tuple(row) for site, row in sites.items()), key=lambda row: (-row[3], row[0]))
+
+    @staticmethod
+    def report(limit=None):
+        """
+        Returns the table of the sites sorted by their own time
+        :param limit:   number of the sites to show (all of them by default)
+        :return: str:
+        """
+        lines = ["%10s %12s %12s  %s" % ("calls", "total ms", "own ms", "tag")]
+        for site, calls, total, own in SuitProfiler.table()[:limit]:
+            lines.append("%10d %12.3f %12.3f  %s" % (calls, total * 1000, own * 1000, site))
+        return "\n".join(lines)
+
+    @staticmethod
+    def collapsed():
+        """
+        Returns the records as collapsed stacks: sites of the path separated by semicolons and the own time in microseconds
+        :return: list:  ["subfolder/page.html;list items (subfolder/page.html:3:5) 1520", ...]
+        """
+        return [
+            "%s %d" % (";".join(site.replace(";", ",") for site in path), round(own * 1000000))
+            for path, (calls, total, own) in sorted(SuitProfiler.paths().items())
+        ]
+
+    @staticmethod
+    def dump(filename):
+        """ Writes collapsed stacks into the file for flamegraph.pl, speedscope and similar tools """
+        with open(filename, "w") as f:
+            f.writelines(line + "\n" for line in SuitProfiler.collapsed())
+
+
+class SuitPending(object):
+    """
+    Awaitable value of the template's data, which is awaited when it is used for the first time
+    The task is shared, so the value used by several includes is awaited only once
+    """
+
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+        self.task = None
+
+    def result(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.awaitable)
+        return self.task
+
+    def close(self):
+        """ Closes the coroutine that has never been awaited """
+        if self.task is None and hasattr(self.awaitable, "close"):
+            self.awaitable.close()
+
+
 class SuitNone(object):
-    """ Represents None, but with more complicated logic """
+    """
+    Represents None, but with more complicated logic
+    Instances are immutable and shared: SuitNone() is a singleton and instances with values are cached
+    """
 
-    def __init__(self, value=None):
-        self.value = value
+    __slots__ = ("value",)
+
+    # number of the cached instances with values
+    cache_size = 1024
+    _none, _instances = None, {}
+
+    def __new__(cls, value=None):
+        if value is None and cls._none is not None:
+            return cls._none
+        # equal values of different types (1, 1.0, True) must not share an instance
+        key = (type(value), value)
+        try:
+            return cls._instances[key]
+        except (KeyError, TypeError):
+            pass
+        instance = object.__new__(cls)
+        object.__setattr__(instance, "value", value)
+        if value is not None and len(cls._instances) < cls.cache_size:
+            try:
+                cls._instances[key] = instance
+            except TypeError:
+                pass
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SuitNone is immutable")
+
+    def __reduce__(self):
+        return SuitNone, (self.value,)
 
     def get(self, key):
         return self.value
@@ -1202,7 +2995,7 @@ class SuitNone(object):
         return self.value if self.value is not None else "SuitNone()"
 
     def __getitem__(self, key):
-        return SuitNone(self.value)
+        return self
 
     def __len__(self):
         return 0
@@ -1236,6 +3029,46 @@ class SuitNone(object):
         return ""
 
 
+SuitNone._none = SuitNone()
+
+
+# template executed by the worker process of Suit.execute_many()
+_batch_suit = None
+
+
+def _batch_init(path):
+    """ Resolves the template once per worker process of Suit.execute_many() """
+    global _batch_suit
+    _batch_suit = Suit(path)
+
+
+def _batch_execute(data):
+    """ Executes the template of the worker process of Suit.execute_many() """
+    return _batch_suit.execute(data)
+
+
+@lru_cache(maxsize=1024)
+def _read_literal(string):
+    """ Reads python literal from the string, returns the string itself if it is not a literal """
+    try:
+        return literal_eval(string.strip())
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return string
+
+
+def _reject_constant(constant):
+    """ Rejects NaN and Infinity in json literals folded by the compiler: they have no python literal """
+    raise ValueError("unsupported constant: %s" % constant)
+
+
+@lru_cache(maxsize=1024)
+def _data_keys(datatemplate):
+    """ Returns the keys of data used by the include's data template """
+    engine = PythonRenderExpressions()
+    engine.compile(TemplatePart(datatemplate).getDataForCompile())
+    return tuple(engine.keys)
+
+
 def json_dumps_handler(obj):
     """ json dumps handler """
     if isinstance(obj, time):
@@ -1246,6 +3079,66 @@ def json_dumps_handler(obj):
     return None
 
 
+class SuitJson(object):
+    """ JSON backend based on the standard json module, encoder and decoder are created once """
+
+    name = "json"
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(default=json_dumps_handler)
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+    def loads(self, string):
+        return self.decoder.decode(string)
+
+
+class SuitOrjson(SuitJson):
+    """
+    JSON backend based on orjson, it is used only when it is chosen explicitly (json_backend(fast=True)):
+    the output is compact, keeps non-ascii characters (U+2028 and U+2029 too) as is and dumps dataclasses, UUIDs
+    and subclasses of the builtin types natively, so the rendered pages differ from the ones of SuitJson
+    Dates and times are still dumped by json_dumps_handler
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        super().__init__()
+        self.orjson = orjson
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        try:
+            return self.orjson.dumps(obj, default=json_dumps_handler, option=self.options).decode()
+        except self.orjson.JSONEncodeError:
+            # values orjson can't dump, i.e. integers exceeding 64 bits
+            return super().dumps(obj)
+
+    def loads(self, string):
+        return self.orjson.loads(string)
+
+
+def json_backend(fast=False):
+    """
+    Returns the JSON backend, the standard json module by default, so the rendered output doesn't depend on
+    the installed packages
+    :param fast:    use orjson if it is installed (its output is formatted differently, see SuitOrjson)
+    """
+    if fast:
+        try:
+            return SuitOrjson()
+        except ImportError:
+            pass
+    return SuitJson()
+
+
+SuitRunTime.json_backend = json_backend()
+
+
 def json_loads_handler(data):
     """ json loads handler """
     from datetime import datetime
@@ -1267,20 +3160,21 @@ def json_safedumps(content):
     </script>
     So, quotes in the JSON needed to be escaped to not conflict with the string delimiters, newlines had to be removed or they'd cause a JavaScript syntax error, and so-on.
     - - -
-    Originally, the two __literal_slash__ lines didn't exist, and it would fall apart if some of the text had a literal "\n" sequence written out in text, i.e. "\\n", as in this example:
+    A literal "\n" sequence written out in text, i.e. "\\n", must survive, as in this example:
     >>> data = {"message": "Hello\\nworld!"}
     >>> json.dumps(data)
     {"message": "Hello\\nworld!"}
-    What would happen was that the "\\n" substitution would end up matching the "\n" from "\\n" and removing it, leaving an orphaned, single "\" character behind. If that character then ended up touching another letter and it didn't form a valid JSON escape sequence (for example, "\a"), this would cause a JSON parse error in the JavaScript.
-    So, they first rename literal \ characters to __literal_slash__, do all the other substitutions, and then rename it back.
+    If the "\n" substitution matched the "\n" from "\\n" and removed it, an orphaned, single "\" character would be left behind. If that character then ended up touching another letter and it didn't form a valid JSON escape sequence (for example, "\a"), this would cause a JSON parse error in the JavaScript.
+    So, the JSON is split by literal \ characters first, the other substitutions are done within the pieces, and the pieces are joined back with the escaped \ characters.
+    Pieces without escape sequences (usually the whole JSON) are not copied at all.
     """
-    return json.dumps(content, default=json_dumps_handler) \
-        .replace('\\\\', '__literal_slash__') \
-        .replace('\\n', '') \
-        .replace('\\r', '') \
-        .replace('\\"', '\\\\"') \
-        .replace("'", "\\'") \
-        .replace('__literal_slash__', '\\\\\\\\')
+    dumped = SuitRunTime.json_backend.dumps(content)
+    if "\\" in dumped:
+        dumped = "\\\\\\\\".join(
+            piece.replace('\\n', '').replace('\\r', '').replace('\\"', '\\\\"') if "\\" in piece else piece
+            for piece in dumped.split("\\\\")
+        )
+    return dumped.replace("'", "\\'")
 
 
 def trimSpaces(string):
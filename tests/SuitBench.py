@@ -0,0 +1,614 @@
+"""
+    Benchmarks for Suit template engine
+
+    Usage:  python -m tests.SuitBench [benchmark_name ...]
+
+"""
+
+import sys
+import json
+import timeit
+from datetime import datetime
+from collections import OrderedDict
+
+from suit.Suit import TemplatePart, PythonSyntax, PythonRenderSyntax, trimSpaces
+
+
+def compile_python(source, syntax=PythonRenderSyntax, method="execute"):
+    """
+    Compiles template source in memory with given python syntax engine
+    :param source:  template source
+    :param syntax:  syntax engine class
+    :param method:  method of the compiled template to be returned
+    :return:        function(data) that executes compiled template
+    """
+    engine = syntax()
+    compiled = engine.compile(TemplatePart(trimSpaces(source)).getDataForCompile())
+    module = {}
+    exec(engine.module("bench", compiled), module)
+    return getattr(module["bench"](), method)
+
+
+def measure(title, func, number):
+    """
+    Measures execution time of the func and prints a line of the report
+    :return:    executions per second
+    """
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    rate = number / best
+    print("    %-40s %10.1f runs/s  %8.3f ms/run" % (title, rate, best / number * 1000))
+    return rate
+
+
+def compare(title, variants, number):
+    """
+    Measures several implementations of the same thing and prints how much faster the last one is
+    :param variants:    list of (variant_title, func)
+    """
+    print(title)
+    rates = [measure(variant_title, func, number) for variant_title, func in variants]
+    print("    %-40s %10.2fx" % ("speedup", rates[-1] / rates[0]))
+
+
+################################################ Conditions ###########################################################
+
+class EvalSyntax(PythonSyntax):
+    """
+    Compiles conditions and expressions the old way:
+    they are formatted into a string and evaluated with eval() on every execution
+    """
+
+    def compile_code(self, data):
+        return self.compile(data)
+
+    def condition(self, condition, true, false):
+        condition = condition.replace("&&", self.logicand())
+        condition = condition.replace("||", self.logicor())
+        return '''SuitRunTime.opt(%s, lambda: %s, lambda: %s)''' % (condition, true, false if false else "")
+
+    def expression(self, expression):
+        return "SuitRunTime.expression(%s)" % expression
+
+
+def bench_conditions():
+    """ List of 1000 items with two conditions per item """
+    source = '''
+        <list for="item" in="items">
+            <if condition="<var>item.price</var> > 100 && <var>item.count</var> != 0">
+                <true><b><var>item.name</var></b></true>
+                <false><var>item.name</var></false>
+            </if>
+            <if condition="<var>i</var> == 1">first</if>
+        </list>
+    '''
+    data = {"items": [{"name": "item%d" % i, "price": i % 200, "count": i % 3} for i in range(1000)]}
+    old, new = compile_python(source, EvalSyntax), compile_python(source, PythonSyntax)
+    assert old(data) == new(data)
+    compare("conditions: list of 1000 items, 2 conditions per item", [
+        ("eval() of formatted condition", lambda: old(data)),
+        ("native python condition", lambda: new(data)),
+    ], number=10)
+
+
+################################################ Expressions ##########################################################
+
+def bench_expressions():
+    """ Report table of 1000 rows with three expressions per row """
+    source = '''
+        <list for="row" in="rows">
+            <tr>
+                <td><expression><var>row.price</var> * <var>row.count</var></expression></td>
+                <td><expression>(<var>row.price</var> * <var>row.count</var>) * 0.18</expression></td>
+                <td><expression><var>row.count</var> % 7 + 1</expression></td>
+            </tr>
+        </list>
+    '''
+    data = {"rows": [{"price": i % 200, "count": i % 13} for i in range(1000)]}
+    old, new = compile_python(source, EvalSyntax), compile_python(source, PythonSyntax)
+    assert old(data) == new(data)
+    compare("expressions: table of 1000 rows, 3 expressions per row", [
+        ("eval() of formatted expression", lambda: old(data)),
+        ("native python expression", lambda: new(data)),
+    ], number=10)
+
+
+############################################ Render functions #########################################################
+
+def bench_render():
+    """ Catalog page: nested lists, conditions, filters and defaults """
+    source = '''
+        <html><head><title><var>title</var></title></head><body>
+        <h1><var d="Catalog">header</var></h1>
+        <list for="category" in="categories">
+            <h2><var>category.name</var> (<var filter="length">category.products</var>)</h2>
+            <ul>
+            <list for="product" in="category.products">
+                <li class="<if condition="<var>i</var> == 1">first</if>">
+                    <a href="/p/<var>product.id</var>"><var>product.title</var></a>
+                    <if condition="<var>product.price</var> > 0">
+                        <true><span><var>product.price</var> RUB</span></true>
+                        <false><span>free</span></false>
+                    </if>
+                    <var d="">product.note</var>
+                </li>
+            </list>
+            </ul>
+        </list>
+        </body></html>
+    '''
+    data = {
+        "title": "Catalog & prices",
+        "categories": [
+            {"name": "category %d" % c, "products": [
+                {"id": p, "title": "product <%d>" % p, "price": p % 5 * 100} for p in range(50)
+            ]} for c in range(20)
+        ]
+    }
+    old, new = compile_python(source, PythonSyntax), compile_python(source, PythonRenderSyntax)
+    assert old(data) == new(data)
+    compare("render: catalog page, 20 categories x 50 products", [
+        ("single expression (PythonSyntax)", lambda: old(data)),
+        ("render function (PythonRenderSyntax)", lambda: new(data)),
+    ], number=20)
+
+
+def bench_stream():
+    """ Time to the first chunk and peak memory of the large report page: execute() vs execute_iter() """
+    import tracemalloc
+
+    source = '''
+        <html><head><title><var>title</var></title></head><body><table>
+        <list for="row" in="rows">
+            <tr><td><var>row.id</var></td><td><var>row.name</var></td><td><var>row.total</var></td></tr>
+        </list>
+        </table></body></html>
+    '''
+    data = {"title": "Report", "rows": [{"id": i, "name": "row %d" % i, "total": i * 3.5} for i in range(100000)]}
+    execute = compile_python(source)
+    execute_iter = compile_python(source, method="execute_iter")
+    print("stream: report page, 100000 rows")
+    for title, first_chunk, consume in [
+        ("execute()", lambda: execute(data), lambda: len(execute(data))),
+        ("execute_iter()", lambda: next(iter(execute_iter(data))), lambda: sum(map(len, execute_iter(data)))),
+    ]:
+        ttfb = min(timeit.repeat(first_chunk, number=1, repeat=3))
+        tracemalloc.start()
+        consume()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("    %-40s first chunk %8.3f ms  peak memory %8.1f KB" % (title, ttfb * 1000, peak / 1024))
+
+
+############################################## Variable accessors #####################################################
+
+class LambdaSyntax(PythonSyntax):
+    """ Reads variables the old way: SuitRunTime.var(lambda ctx: ctx[...], default, ctx) """
+
+    def accessor(self, var_name, root=None):
+        return None
+
+
+def bench_accessors():
+    """ List of 1000 users where most of the optional fields are missing """
+    source = '''
+        <list for="user" in="users">
+            <div>
+                <var>user.name</var> <var d="">user.profile.city</var> <var d="">user.profile.phones.[0]</var>
+                <var d="-">user.company.title</var> <var d="<var>defaults.role</var>">user.role</var>
+                <if condition="<var>user.profile.vip</var>">VIP</if>
+            </div>
+        </list>
+    '''
+    data = {
+        "defaults": {"role": "guest"},
+        "users": [{"name": "user %d" % i, "profile": {"city": "Moscow"} if i % 10 == 0 else None} for i in range(1000)]
+    }
+    old, new = compile_python(source, LambdaSyntax), compile_python(source, PythonSyntax)
+    assert old(data) == new(data)
+    compare("accessors: 1000 users, most of the fields missing", [
+        ("SuitRunTime.var(lambda ...)", lambda: old(data)),
+        ("compiled accessors", lambda: new(data)),
+    ], number=20)
+
+
+class AllocatedNone(object):
+    """ SuitNone the old way: a new instance for every missing variable and every further path segment """
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def __str__(self):
+        return self.value if self.value is not None else "SuitNone()"
+
+    def __getitem__(self, key):
+        return AllocatedNone(self.value)
+
+    def __len__(self):
+        return 0
+
+
+def bench_none():
+    """ List of 1000 products where the optional fields are missing and printed by the filters """
+    source = '''
+        <list for="product" in="products">
+            <var filter="length">product.options</var><var filter="length">product.tags</var>
+            <var filter="length">product.vendor.name</var><var filter="length">product.vendor.country.code</var>
+        </list>
+    '''
+    data = {"products": [{"id": i} for i in range(1000)]}
+    engine = PythonRenderSyntax()
+    compiled = engine.compile(TemplatePart(trimSpaces(source)).getDataForCompile())
+    old, new = {}, {}
+    exec(engine.module("bench", compiled), old)
+    exec(engine.module("bench", compiled), new)
+    old["SuitNone"] = AllocatedNone
+    assert old["render"](data) == new["render"](data)
+    compare("none: 1000 products, 4 missing fields per product", [
+        ("new SuitNone per missing variable", lambda: old["render"](data)),
+        ("shared SuitNone", lambda: new["render"](data)),
+    ], number=50)
+
+
+################################################ Filter data ##########################################################
+
+class TextDataSyntax(PythonRenderSyntax):
+    """ Passes literal filter data as text, so the filters parse it on every call """
+
+    def __init__(self):
+        super().__init__()
+        self.expressions.filter_data = lambda filter_name, filter_data: self.expressions.try_compile(filter_data)
+
+
+def bench_filter_data():
+    """ List of 1000 orders with literal data of in, notin and plural_form filters """
+    source = '''
+        <list for="order" in="orders">
+            <var filter="in" in-data='["new","paid","shipped"]'>order.status</var>
+            <var filter="notin" notin-data='["cancelled","refunded"]'>order.status</var>
+            <var filter="plural_form" plural_form-data='["товар","товара","товаров"]'>order.count</var>
+        </list>
+    '''
+    statuses = ["new", "paid", "shipped", "cancelled", "refunded"]
+    data = {"orders": [{"status": statuses[i % 5], "count": i % 30} for i in range(1000)]}
+    old, new = compile_python(source, TextDataSyntax), compile_python(source)
+    assert old(data) == new(data)
+    compare("filter data: 1000 orders, 3 filters with literal data", [
+        ("json.loads on every call", lambda: old(data)),
+        ("constants folded by the compiler", lambda: new(data)),
+    ], number=20)
+
+
+class UnmemoizedSyntax(PythonRenderSyntax):
+    """ Calls pure filters on every use instead of memoizing their results during the render """
+
+    def __init__(self):
+        super().__init__()
+        self.expressions.filter = lambda filter_name, var, data=None: PythonSyntax.filter(
+            self.expressions, filter_name, var, data
+        )
+
+
+def bench_filter_memo():
+    """ Feed of 1000 posts: dates formatted by dateformat and plural forms of the comments counters """
+    source = '''
+        <list for="post" in="posts">
+            <time><var filter="dateformat" dateformat-data="%d.%m.%Y">post.date</var></time>
+            <var filter="plural_form" plural_form-data='["комментарий","комментария","комментариев"]'>post.comments</var>
+        </list>
+    '''
+    data = {"posts": [{"date": datetime(2020, 1, 1 + i % 7).ctime(), "comments": i % 10} for i in range(1000)]}
+    old, new = compile_python(source, UnmemoizedSyntax), compile_python(source)
+    assert old(data) == new(data)
+    compare("filter memo: 1000 posts, dateformat and plural_form", [
+        ("filter called on every use", lambda: old(data)),
+        ("pure filters memoized per render", lambda: new(data)),
+    ], number=20)
+
+
+################################################ List items ###########################################################
+
+class PathSyntax(PythonRenderSyntax):
+    """ Reads list items by their full path from the root of the template's data """
+
+    def bind(self, var_name):
+        return None, var_name
+
+
+def bench_loops():
+    """ Nested lists: 20 orders x 50 lines, 4 variables per line """
+    source = '''
+        <list for="order" in="orders">
+            <h2><var>order.number</var></h2>
+            <list for="line" in="order.lines">
+                <tr><td><var>i</var></td><td><var>line.title</var></td><td><var>line.price</var> x <var>line.count</var></td>
+                <td><var>order.currency</var></td></tr>
+            </list>
+        </list>
+    '''
+    data = {"orders": [
+        {"number": o, "currency": "RUB", "lines": [{"title": "line %d" % l, "price": l, "count": 2} for l in range(50)]}
+        for o in range(20)
+    ]}
+    old, new = compile_python(source, PathSyntax), compile_python(source, PythonRenderSyntax)
+    assert old(data) == new(data)
+    compare("loops: 20 orders x 50 lines", [
+        ("full path lookups", lambda: old(data)),
+        ("items bound once per iteration", lambda: new(data)),
+    ], number=50)
+
+
+################################################ JSON backends ########################################################
+
+class ModuleJson(object):
+    """ JSON the old way: json.dumps() and json.loads() with the arguments on every call """
+
+    name = "json.dumps/json.loads"
+
+    @staticmethod
+    def dumps(obj):
+        from suit.Suit import json_dumps_handler
+        return json.dumps(obj, default=json_dumps_handler)
+
+    @staticmethod
+    def loads(string):
+        return json.loads(string, object_pairs_hook=OrderedDict)
+
+
+def bench_json():
+    """ JSON call sites: printing of list/dict variables, suit_environment and include's data """
+    from suit.Suit import SuitRunTime, SuitJson, json_backend, json_safedumps
+
+    users = [{"id": i, "name": "user %d" % i, "tags": ["a", "b"], "created": datetime(2020, 1, 1)} for i in range(100)]
+    scope = ModuleJson.dumps({"user": users[0], "items": list(range(20)), "title": "Include's data"})
+    backend = SuitRunTime.json_backend
+    try:
+        for title, call in [
+            ("stringify: list of 100 dicts", lambda: SuitRunTime.stringify(users)),
+            ("json_safedumps: suit_environment", lambda: json_safedumps({"users": users})),
+            ("include data: loads of the rendered scope", lambda: SuitRunTime.json_backend.loads(scope)),
+        ]:
+            print(title)
+            rates = []
+            for SuitRunTime.json_backend in [ModuleJson, SuitJson(), json_backend(fast=True)]:
+                rates.append(measure("%s" % SuitRunTime.json_backend.name, call, 2000))
+            print("    %-40s %10.2fx" % ("speedup", rates[-1] / rates[0]))
+    finally:
+        SuitRunTime.json_backend = backend
+
+
+def bench_safedumps():
+    """ json_safedumps of the large suit_environment: plain data and data with quotes, newlines and backslashes """
+    from suit.Suit import SuitRunTime, json_safedumps
+
+    def replaces(content):
+        return SuitRunTime.json_backend.dumps(content) \
+            .replace('\\\\', '__literal_slash__') \
+            .replace('\\n', '') \
+            .replace('\\r', '') \
+            .replace('\\"', '\\\\"') \
+            .replace("'", "\\'") \
+            .replace('__literal_slash__', '\\\\\\\\')
+
+    for title, content in [
+        ("plain data", {"users": [{"id": i, "name": "user %d" % i, "tags": ["a", "b"]} for i in range(2000)]}),
+        ("escaped data", {"users": [
+            {"id": i, "bio": "He said \"hi\"\nIt's C:\\path" if i % 3 == 0 else "plain text"} for i in range(2000)
+        ]}),
+    ]:
+        assert replaces(content) == json_safedumps(content)
+        compare("safedumps: suit_environment of 2000 users, %s" % title, [
+            ("chain of replaces", lambda: replaces(content)),
+            ("json_safedumps", lambda: json_safedumps(content)),
+        ], number=100)
+
+
+################################################ Include's data #######################################################
+
+def bench_include_data():
+    """ Data of the include inside of the list: rendering of the data block into json vs compiled dict """
+    from suit.Suit import SuitRunTime, PythonRenderExpressions
+
+    body = '''{"user": <var>users.[user]</var>, "title": "<var>title</var>: <var>users.[user].name</var>", "page": 1}'''
+    data = {"title": "Users", "users": [{"id": i, "name": "user %d" % i} for i in range(100)]}
+    engine, module = PythonRenderExpressions(), {}
+    scope = engine.scope(body)
+    exec("from suit.Suit import SuitRunTime, SuitNone\n%s\n\n\ndef scope(ctx, user):\n    return lambda: %s" % (
+        engine.accessors_source(), scope
+    ), module)
+    assert dict(SuitRunTime.include_data({"user": 1}, lambda: data, body)) == \
+        dict(SuitRunTime.include_data({}, lambda: data, module["scope"](data, 1)), itervar_user=1)
+
+    def old():
+        for user in range(100):
+            SuitRunTime.include_data({"user": user}, lambda: data, body)
+
+    def new():
+        for user in range(100):
+            SuitRunTime.include_data({}, lambda: data, module["scope"](data, user))
+
+    compare("include data: 100 includes in the list", [
+        ("rendered json block", old),
+        ("compiled dict", new),
+    ], number=20)
+
+
+################################################ Batch render #########################################################
+
+def bench_batch():
+    """ Throughput of the mass mailing: one letter template rendered for 20000 recipients """
+    import os
+    import shutil
+    import tempfile
+    from suit.Suit import Compiler, Suit
+
+    source = '''
+        <html><body><p>Dear <var>user.name</var>,</p>
+        <table><list for="line" in="order.lines"><tr><td><var>line.title</var></td><td><var>line.price</var></td></tr></list></table>
+        <if condition="<var>order.total</var> > 1000"><true><p>Free delivery!</p></true></if>
+        </body></html>
+    '''
+    batch = [{"user": {"name": "user %d" % i}, "order": {
+        "total": i % 2000, "lines": [{"title": "line %d" % l, "price": l * 10} for l in range(10)]
+    }} for i in range(20000)]
+
+    cwd, root = os.getcwd(), tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, "views", "mail"))
+        with open(os.path.join(root, "views", "mail", "letter.html"), "w") as f:
+            f.write(source)
+        os.chdir(os.path.join(root, "views"))
+        Compiler().compile()
+        os.chdir(root)
+        sys.path.insert(0, root)
+        processes = os.cpu_count() or 1
+        print("batch: letter template for %d recipients, %d cpu" % (len(batch), processes))
+        rates = []
+        for title, run in [
+            ("Suit(name).execute(data) loop", lambda: [Suit("views.mail.letter").execute(data) for data in batch]),
+            ("execute_many()", lambda: list(Suit("views.mail.letter").execute_many(batch))),
+            ("execute_many(processes)", lambda: list(Suit("views.mail.letter").execute_many(batch, processes))),
+            ("execute_many(processes, ordered=False)",
+             lambda: list(Suit("views.mail.letter").execute_many(batch, processes, ordered=False))),
+        ]:
+            best = min(timeit.repeat(run, number=1, repeat=3))
+            rates.append(len(batch) / best)
+            print("    %-40s %10.1f letters/s  %6.2fx" % (title, rates[-1], rates[-1] / rates[0]))
+    finally:
+        sys.path.remove(root)
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+################################################ Bundle ###############################################################
+
+def bench_bundle():
+    """ Cold start: loading of 500 compiled templates from their modules and from the bundle """
+    import os
+    import shutil
+    import tempfile
+    from suit.Suit import Compiler, Suit
+
+    cwd, root = os.getcwd(), tempfile.mkdtemp()
+    try:
+        for folder in range(10):
+            os.makedirs(os.path.join(root, "views", "folder%d" % folder))
+            for num in range(50):
+                with open(os.path.join(root, "views", "folder%d" % folder, "page%d.html" % num), "w") as f:
+                    f.write('''<h1><var>title</var></h1><list for="item" in="items"><p><var>item.name</var></p></list>''')
+        os.chdir(os.path.join(root, "views"))
+        compiler = Compiler()
+        compiler.compile()
+        os.chdir(root)
+        sys.path.insert(0, root)
+        # packages of the previous benchmarks are imported from their own temporary roots
+        for module in [module for module in sys.modules if module == "views" or module.startswith("views.")]:
+            sys.modules.pop(module)
+
+        def load():
+            Suit.registry.invalidate()
+            return Suit.preload("views", freeze=False)["total"]
+
+        print("bundle: cold start of 500 templates")
+        load()
+        modules = min(load() for _ in range(3))
+        print("    %-40s %10.3f ms" % ("module per template", modules * 1000))
+        os.chdir(os.path.join(root, "views"))
+        compiler.bundle()
+        os.chdir(root)
+        bundle = min(load() for _ in range(3))
+        print("    %-40s %10.3f ms  %6.2fx" % ("bundle", bundle * 1000, modules / bundle))
+    finally:
+        Suit.registry.invalidate()
+        sys.path.remove(root)
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+################################################ Profiler #############################################################
+
+def bench_profile():
+    """ Cost of the profiling: templates compiled by PythonProfileSyntax and by PythonRenderSyntax """
+    from suit.Suit import PythonProfileSyntax, SuitProfiler
+
+    source = '''
+        <list for="order" in="orders">
+            <div>
+                <var>order.id</var> <var filter="length">order.items</var>
+                <list for="item" in="order.items">
+                    <if condition="<var>item.price</var> > 100"><true><b><var>item.title</var></b></true></if>
+                </list>
+            </div>
+        </list>
+    '''
+    data = {"orders": [
+        {"id": o, "items": [{"title": "item %d" % i, "price": i * 20} for i in range(10)]} for o in range(200)
+    ]}
+    plain, profiled = compile_python(source, PythonRenderSyntax), compile_python(source, PythonProfileSyntax)
+    assert plain(data) == profiled(data)
+    compare("profile: 200 orders x 10 items", [
+        ("profiled (PythonProfileSyntax)", lambda: profiled(data)),
+        ("not instrumented (PythonRenderSyntax)", lambda: plain(data)),
+    ], number=20)
+    for line in SuitProfiler.report(limit=5).split("\n"):
+        print("    " + line)
+    SuitProfiler.reset()
+
+
+################################################ Fragment cache #######################################################
+
+def bench_cache():
+    """ Page with the menu and the sidebar which depend on slow-changing data: rendered every time and cached """
+    from suit.Suit import Suit
+
+    menu = '''
+        <ul><list for="section" in="sections">
+            <li><a href="/<var>section.slug</var>"><var filter="length">section.items</var> <var>section.title</var></a>
+            <ul><list for="item" in="section.items"><li><var>item.title</var></li></list></ul></li>
+        </list></ul>
+    '''
+    source = '''
+        <html><body>%s<main><h1><var>title</var></h1></main>%s</body></html>
+    '''
+    data = {
+        "title": "Page",
+        "sections": [
+            {"slug": "s%d" % s, "title": "Section %d" % s, "items": [{"title": "item %d" % i} for i in range(20)]}
+            for s in range(10)
+        ]
+    }
+    plain = compile_python(source % (menu, menu))
+    cached = compile_python(source % (
+        '<cache key="menu" ttl="60">%s</cache>' % menu, '<cache key="sidebar" ttl="60">%s</cache>' % menu
+    ))
+    Suit.fragments.clear()
+    assert plain(data) == cached(data)
+    compare("cache: page with 2 menus of 10 sections x 20 items", [
+        ("rendered on every execution", lambda: plain(data)),
+        ("<cache> fragments", lambda: cached(data)),
+    ], number=200)
+    Suit.fragments.clear()
+
+
+BENCHMARKS = {
+    "conditions": bench_conditions,
+    "expressions": bench_expressions,
+    "render": bench_render,
+    "stream": bench_stream,
+    "accessors": bench_accessors,
+    "none": bench_none,
+    "filter_data": bench_filter_data,
+    "filter_memo": bench_filter_memo,
+    "loops": bench_loops,
+    "json": bench_json,
+    "safedumps": bench_safedumps,
+    "include_data": bench_include_data,
+    "batch": bench_batch,
+    "bundle": bench_bundle,
+    "profile": bench_profile,
+    "cache": bench_cache,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
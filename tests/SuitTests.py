@@ -14,6 +14,7 @@ from datetime import datetime, date, time
 
 
 from suit.Suit import XmlTag, PythonSyntax, JavascriptSyntax, Compiler, Suit, suit, trimSpaces, json_dumps_handler
+from suit.Suit import TemplateParseError
 
 
 # Получаем результат выполнения скомпилированного js кода
@@ -100,7 +101,6 @@ class SuitTest(unittest.TestCase):
             # Получаем скомпилированный python ход
             f = open("views/__py__/subfolder_%s.py" % fileName)
             compiled_python = "".join(f.readlines())
-            compiled_python = re.search("return \((.+)\)", compiled_python).group(1)
             f.close()
             print("PY: ", compiled_python)
 
@@ -650,6 +650,28 @@ class SuitTest(unittest.TestCase):
         self.simulate(template, "Нет", {"isOk": None, "value": 3})
         self.simulate(template, "Нет", {})
 
+    def test_condition_compiled_natively(self):
+        """
+        Условия компилируются в python-выражения, а не вычисляются через eval во время выполнения.
+        Значения переменных при этом трактуются так же, как если бы были подставлены в текст условия
+
+        """
+        template = '''
+            <list for="item" in="items">
+                <if condition="<var>item.n</var> > 10 && '<var>item.s</var>' == 'x'">
+                    <true>+</true>
+                    <false>-</false>
+                </if>
+            </list>
+        '''
+        items = [{"n": 11, "s": "x"}, {"n": "12", "s": "x"}, {"n": 11, "s": "y"}, {"n": 9, "s": "x"}, {"s": "x"}]
+        self.simulate(template, "++---", {"items": items}, name="nativeCondition")
+
+        f = open("views/__py__/subfolder_nativeCondition.py")
+        compiled_python = f.read()
+        f.close()
+        self.assertEqual(-1, compiled_python.find("SuitRunTime.opt("))
+
     # #################################### Lists ###################################
 
     def test_list(self):
@@ -881,6 +903,24 @@ class SuitTest(unittest.TestCase):
         self.simulate("<expression>1 + 3</expression>", "4")
         self.simulate("<expression>1 + <var>someVar</var></expression>", "4", {"someVar": "3"})
 
+    def test_expression_in_list(self):
+        """
+        Выражения компилируются в python-код, а не вычисляются через eval во время выполнения
+
+        """
+        template = '''
+            <list for="row" in="rows">
+                <expression><var>row.price</var> * <var>row.count</var> % 7</expression>;
+            </list>
+        '''
+        rows = [{"price": 2, "count": 3}, {"price": "5", "count": 3}, {"price": 1, "count": 0}]
+        self.simulate(template, "6;1;0;", {"rows": rows}, name="nativeExpression")
+
+        f = open("views/__py__/subfolder_nativeExpression.py")
+        compiled_python = f.read()
+        f.close()
+        self.assertEqual(-1, compiled_python.find("SuitRunTime.expression("))
+
     #################################### Embedded CSS ###################################
     def test_embeddedCSS(self):
         """
@@ -1192,6 +1232,44 @@ class SuitTest(unittest.TestCase):
         self.simulate(list_template1, "-1--1-", {"users": ["Andrey", "Nikolay"], "a": 1})
         self.simulate(list_template2, "-Andrey--Nikolay-", {"users": ["Andrey", "Nikolay"], "a": 1})
 
+    def test_breakPoint_include_shares_data(self):
+        """ Данные шаблона передаются во включаемый шаблон без копирования и не изменяются им """
+        from threading import Lock
+
+        inc_template = '''-<var>a</var><var>b</var>-'''
+        list_template = '''<list for="user" in="users"><breakpoint include="subfolder.inc_shared">{"a": "<var>user</var>"}</breakpoint></list>'''
+        self.simulate(inc_template, "-12-", {"a": 1, "b": 2}, name="inc_shared")
+
+        # Объекты, которые невозможно скопировать, не мешают включению шаблонов
+        data = {"users": ["Andrey", "Nikolay"], "a": 1, "b": "!", "lock": Lock()}
+        self.simulate(list_template, "-Andrey!--Nikolay!-", data)
+        self.assertEqual(1, data["a"])
+        self.assertEqual(["users", "a", "b", "lock"], list(data))
+
+    def test_breakPoint_include_data_compiled(self):
+        """
+        Данные включения собираются скомпилированным кодом без рендеринга в json: значения вне строк передаются
+        как есть, внутри строк подставляется их текст, а невалидный json обнаруживается при компиляции
+        """
+        inc_template = '''-<var>a.[1]</var>-<var>b</var>-<var>c</var>-'''
+        template = '''<list for="user" in="users"><breakpoint include="subfolder.inc_compiled">''' \
+                   '''{"a": <var>items</var>, "b": "<var>user.name</var> & co", "c": <var>user.id</var>}''' \
+                   '''</breakpoint></list>'''
+        self.simulate(inc_template, "-2-x-3-", {"a": [1, 2], "b": "x", "c": 3}, name="inc_compiled")
+        self.simulate(template, "-2-Andrey &amp; co-1--2-Nikolay &amp; co-2-", {
+            "items": [1, 2], "users": [{"name": "Andrey", "id": 1}, {"name": "Nikolay", "id": 2}]
+        }, name="includeCompiled")
+        # обратные слеши в значениях больше не ломают данные включения
+        data = {"items": [1, "\\"], "users": [{"name": "C:\\new", "id": 1}]}
+        self.assertEqual("-\\-C:\\new &amp; co-1-", Suit("views.subfolder.includeCompiled").execute(data))
+
+        f = open("views/subfolder/invalidData.html", "w+")
+        f.writelines('''<breakpoint include="subfolder.inc_compiled">{"a": <var>items</var>,}</breakpoint>''')
+        f.close()
+        os.chdir("views")
+        self.assertRaises(TemplateParseError, self.c.compile)
+        os.chdir("../")
+
     # ################################# Регрессионные тесты альфа-тестирования ##################################
 
     def test_regressive_specialChars(self):
@@ -1291,6 +1369,81 @@ class SuitTest(unittest.TestCase):
 
         self.assertEqual("1 != 2", getTemplateWithArgs(1))
 
+        # шаблон находится один раз при декорировании и далее используется повторно
+        resolved = []
+        original_init = Suit.__init__
+
+        def counting_init(suit_self, path):
+            resolved.append(path)
+            original_init(suit_self, path)
+
+        Suit.__init__ = counting_init
+        try:
+            self.assertEqual("3 != 2", getTemplateWithArgs(3))
+            self.assertEqual("4 != 2", getTemplateWithArgs(4))
+        finally:
+            Suit.__init__ = original_init
+        self.assertEqual([], resolved)
+
+        # шаблон, еще не скомпилированный в существующий __py__, не мешает декорированию и находится при вызове
+        self.assertTrue(os.path.isdir("views/__py__"))
+
+        @suit("views.subfolder.decoratedLater")
+        def getLaterTemplate():
+            return {"a": 5}
+
+        f = open("views/subfolder/decoratedLater.html", "w+")
+        f.writelines("<var>a</var>!")
+        f.close()
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+        self.assertEqual("5!", getLaterTemplate())
+
+    def test_templates_registry(self):
+        """
+        Классы скомпилированных шаблонов должны находиться один раз и далее браться из реестра
+
+        """
+        self.assertFalse(os.path.isfile("views/subfolder/registryTemplate.html"))
+        f = open("views/subfolder/registryTemplate.html", "w+")
+        f.writelines("0<var>a</var>2")
+        f.close()
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+
+        name = "views.subfolder.registryTemplate"
+        self.assertEqual("012", Suit(name).execute({"a": 1}))
+        self.assertIn(name, Suit.registry.classes)
+        self.assertIs(Suit.registry.get(name), type(Suit(name).template))
+
+        Suit.registry.invalidate(name)
+        self.assertNotIn(name, Suit.registry.classes)
+        self.assertEqual("0x2", Suit(name).execute({"a": "x"}))
+        self.assertIn(name, Suit.registry.classes)
+
+    def test_inline_templates_cache(self):
+        """
+        Встраиваемые шаблоны ("{...}") должны компилироваться один раз и далее браться из кеша
+
+        """
+        source = '''{"a": "<var>a</var>", "b": <var>b</var>}'''
+        Suit.inline_templates.clear()
+        self.assertEqual('''{"a": "1", "b": 2}''', Suit(source).execute({"a": "1", "b": 2}))
+        self.assertEqual('''{"a": "3", "b": 4}''', Suit(source).execute({"a": "3", "b": 4}))
+        self.assertEqual(1, Suit.inline_templates.misses)
+        self.assertEqual(1, Suit.inline_templates.hits)
+
+        # Размер кеша ограничен, вытесняются давно не используемые шаблоны
+        Suit.inline_templates.size = 2
+        Suit('{"c": 1}')
+        Suit('{"d": 1}')
+        self.assertNotIn(source, Suit.inline_templates.templates)
+        self.assertEqual(2, len(Suit.inline_templates.templates))
+        Suit.inline_templates.size = 512
+        Suit.inline_templates.clear()
+
     ########################################### Compiler tests ###################################################
 
     def test_compiler(self):
@@ -1353,6 +1506,614 @@ class SuitTest(unittest.TestCase):
         executed = Suit("views.subfolder.template").execute(data)
         self.assertEqual(expected, executed)
 
+    def test_compiler_render_function(self):
+        """
+        По умолчанию python-шаблоны компилируются в последовательный код функции render(ctx),
+        но можно выбрать и компиляцию в единое выражение (PythonSyntax)
+
+        """
+        template = '''
+            <var>title</var>:
+            <list for="item" in="items">
+                <if condition="<var>item.n</var> > 1"><true><var filter="length">item.name</var></true><false>-</false></if>
+            </list>
+        '''
+        data = {"title": "<b>", "items": [{"n": 1, "name": "a"}, {"n": 2, "name": "bb"}, {"n": 3}]}
+        expected = "&lt;b&gt;:-20"
+
+        f = open("views/subfolder/renderTemplate.html", "w+")
+        f.writelines(template)
+        f.close()
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+        f = open("views/__py__/subfolder_renderTemplate.py")
+        compiled_python = f.read()
+        f.close()
+        self.assertTrue(compiled_python.find("def render(ctx):") > -1)
+        self.assertEqual(expected, Suit("views.subfolder.renderTemplate").execute(data))
+
+        f = open("views/subfolder/expressionTemplate.html", "w+")
+        f.writelines(template)
+        f.close()
+        os.chdir("views")
+        Compiler({"py": PythonSyntax, "js": JavascriptSyntax}).compile()
+        os.chdir("../")
+        f = open("views/__py__/subfolder_expressionTemplate.py")
+        compiled_python = f.read()
+        f.close()
+        self.assertEqual(-1, compiled_python.find("def render(ctx):"))
+        self.assertEqual(expected, Suit("views.subfolder.expressionTemplate").execute(data))
+
+    def test_execute_iter(self):
+        """ Результат выполнения шаблона можно получать частями по мере выполнения шаблона """
+        from suit.Suit import SuitRunTime
+
+        inc_template = '''[<var>a</var>]'''
+        template = '''
+            <h1><var>title</var></h1>
+            <list for="item" in="items">
+                <if condition="<var>item</var> > 2"><true>+</true><false>-</false></if>
+                <breakpoint include="subfolder.inc_streamed">{"a": "<var>item</var>"}</breakpoint>
+            </list>
+            <list for="item" in="items"><var>item</var></list>
+        '''
+        data = {"title": "Stream", "items": list(range(10))}
+        self.simulate(inc_template, "[1]", {"a": 1}, name="inc_streamed")
+        expected = "<h1>Stream</h1>" + "".join("%s[%s]" % ("+" if i > 2 else "-", i) for i in range(10)) + "0123456789"
+        self.simulate(template, expected, data, name="streamed")
+
+        stream_buffer = SuitRunTime.stream_buffer
+        SuitRunTime.stream_buffer = 4
+        try:
+            chunks = list(Suit("views.subfolder.streamed").execute_iter(data))
+            encoded = list(Suit("views.subfolder.streamed").execute_iter(data, encoding="utf-8"))
+        finally:
+            SuitRunTime.stream_buffer = stream_buffer
+        self.assertTrue(len(chunks) > 10)
+        self.assertEqual(expected, "".join(chunks))
+        self.assertEqual(expected.encode("utf-8"), b"".join(encoded))
+
+    def test_flush(self):
+        """ Тег <flush/> отдает накопленный результат клиенту; место сброса может задавать базовый шаблон """
+        layout = '''
+            <html><head><title><var>title</var></title></head><flush/><body><breakpoint name="content"></breakpoint></body></html>
+        '''
+        page = '''
+            <rebase>subfolder.flushLayout</rebase>
+            <breakpoint name="content"><list for="item" in="items"><if condition="<var>item</var> > 1"><flush/></if><var>item</var></list></breakpoint>
+        '''
+        data = {"title": "Flush", "items": [1, 2, 3]}
+        self.simulate(layout, "<html><head><title>Flush</title></head><body></body></html>", data, "flushLayout")
+        self.simulate(page, "<html><head><title>Flush</title></head><body>123</body></html>", data, "flushPage")
+
+        chunks = list(Suit("views.subfolder.flushPage").execute_iter(data))
+        self.assertEqual(["<html><head><title>Flush</title></head>", "<body>1", "2", "3</body></html>"], chunks)
+
+    def test_environment(self):
+        """
+        suit_environment вставляется перед </head> только страницами с блоками auto-refresh (в том числе во включаемых
+        шаблонах) и содержит только используемые шаблонами страницы переменные: место вставки определяется
+        при компиляции, поэтому данные передаются и в потоковом режиме; блоки auto-refresh внутри условий
+        проверяются по результату
+        """
+        script = re.compile('<script id="suit_environment_script">.*?</script>')
+        inc_template = '''<div auto-refresh="count"><var>count</var></div>'''
+        page = '''<!DOCTYPE html><html><head><title><var>title</var></title></head><body>''' \
+               '''<breakpoint include="subfolder.envInc">{"count": "<var>count</var>"}</breakpoint></body></html>'''
+        plain = '''<!DOCTYPE html><html><head><title><var>title</var></title></head><body></body></html>'''
+        data = {"title": "Env", "count": 2}
+        expected = "<!DOCTYPE html><html><head><title>Env</title></head><body><div auto-refresh=\"count\">2</div></body></html>"
+        self.simulate(inc_template, "<div auto-refresh=\"count\">2</div>", {"count": 2}, name="envInc")
+        self.simulate(page, expected, data, name="envPage", filterForExecuted=lambda res: script.sub("", res))
+        self.simulate(plain, "<!DOCTYPE html><html><head><title>Env</title></head><body></body></html>", data,
+                      name="envPlain")
+
+        executed = Suit("views.subfolder.envPage").execute(data)
+        self.assertEqual(1, len(script.findall(executed)))
+        self.assertIn("</script></head>", executed)
+        self.assertEqual(executed, "".join(Suit("views.subfolder.envPage").execute_iter(data)))
+        self.assertIs(True, Suit("views.subfolder.envPage").template.environment)
+        self.assertEqual(("count", "title"), Suit("views.subfolder.envPage").template.environment_keys)
+        executed = Suit("views.subfolder.envPage").execute(dict(data, unused=[1, 2]))
+        self.assertEqual({"count": 2, "title": "Env"}, json.loads(
+            executed.split("window.suit_environment='")[1].split("'</script>")[0].replace("\\\\", "\\")))
+        self.assertIs(False, Suit("views.subfolder.envPlain").template.environment)
+        self.assertIs(False, Suit("views.subfolder.envInc").template.environment)
+
+        hidden_data, shown_data = {"show": False, "count": 1}, {"show": True, "count": 1}
+        conditional = '''<!DOCTYPE html><html><head></head><body><if condition="<var>show</var>">''' \
+                      '''<div auto-refresh="count"><var>count</var></div></if></body></html>'''
+        self.simulate(conditional, "<!DOCTYPE html><html><head></head><body></body></html>", hidden_data,
+                      name="envConditional")
+        self.assertIs(None, Suit("views.subfolder.envConditional").template.environment)
+        hidden = Suit("views.subfolder.envConditional").execute(hidden_data)
+        self.assertEqual([], script.findall(hidden))
+        self.assertEqual([hidden], list(Suit("views.subfolder.envConditional").execute_iter(hidden_data)))
+        shown = Suit("views.subfolder.envConditional").execute(shown_data)
+        self.assertEqual(1, len(script.findall(shown)))
+        self.assertEqual([shown], list(Suit("views.subfolder.envConditional").execute_iter(shown_data)))
+
+        # переменные с вложенными переменными в атрибутах передаются вместе с ними
+        nested_data = {"needle": "a", "haystack": ["a"], "primary": None, "fallback": "f", "unused": 1}
+        nested = '''<!DOCTYPE html><html><head></head><body><div auto-refresh="needle">''' \
+                 '''<var filter="in" in-data="<var>haystack</var>">needle</var>|''' \
+                 '''<var d="<var>fallback</var>">primary</var></div></body></html>'''
+        self.simulate(nested, '<!DOCTYPE html><html><head></head><body><div auto-refresh="needle">True|f</div></body>'
+                              '</html>', nested_data, name="envNested",
+                      filterForExecuted=lambda res: script.sub("", res).replace("true|", "True|"))
+        self.assertEqual(("fallback", "haystack", "needle", "primary"),
+                         Suit("views.subfolder.envNested").template.environment_keys)
+        executed = Suit("views.subfolder.envNested").execute(nested_data)
+        self.assertEqual({"needle": "a", "haystack": ["a"], "primary": None, "fallback": "f"}, json.loads(
+            executed.split("window.suit_environment='")[1].split("'</script>")[0].replace("\\\\", "\\")))
+
+    def test_execute_many(self):
+        """ Шаблон выполняется для множества данных: в текущем процессе или в пуле процессов, с порядком и без """
+        template = '''<h1><var>title</var></h1><list for="item" in="items"><var>item</var>,</list>'''
+        self.simulate(template, "<h1>Batch</h1>1,2,", {"title": "Batch", "items": [1, 2]}, name="batch")
+        batch = [{"title": "Batch %d" % i, "items": list(range(i))} for i in range(50)]
+        expected = [Suit("views.subfolder.batch").execute(data) for data in batch]
+
+        self.assertEqual(expected, list(Suit("views.subfolder.batch").execute_many(batch)))
+        self.assertEqual(expected, list(Suit("views.subfolder.batch").execute_many(iter(batch), processes=2, chunksize=4)))
+        self.assertEqual(sorted(expected), sorted(
+            Suit("views.subfolder.batch").execute_many(batch, processes=2, ordered=False, chunksize=4)
+        ))
+
+    def test_preload(self):
+        """ Все скомпилированные шаблоны загружаются заранее, прогреваются на примере данных и замораживаются для gc """
+        import gc
+
+        self.simulate('''<h1><var>title</var></h1>''', "<h1>Preload</h1>", {"title": "Preload"}, name="preloadTitle")
+        self.simulate('''<expression>7 / <var>n</var></expression>''', "3.5", {"n": 2}, name="preloadRatio")
+        Suit.registry.invalidate()
+        report = Suit.preload("views", sample=lambda name: {"title": "Preload", "n": 2}, freeze=False)
+        self.assertEqual(2, report["modules"])
+        self.assertEqual(2, report["templates"])
+        self.assertEqual({}, report["errors"])
+        self.assertIn("views.subfolder.preloadTitle", Suit.registry.classes)
+        self.assertIn("views.subfolder.preloadRatio", Suit.registry.classes)
+        self.assertTrue(report["total"] >= report["import"] + report["warmup"])
+
+        if hasattr(gc, "freeze"):
+            try:
+                report = Suit.preload("views", sample={"title": "Preload", "n": 0})
+                self.assertTrue(gc.get_freeze_count() > 0)
+            finally:
+                gc.unfreeze()
+            self.assertEqual(["views.subfolder.preloadRatio"], list(report["errors"]))
+
+    def test_bundle(self):
+        """ Скомпилированные python-шаблоны собираются в единый файл, из которого они загружаются без импорта модулей """
+        import sys
+        from suit.Suit import TemplatesRegistry
+
+        self.simulate('''<h1><var>title</var></h1>''', "<h1>Bundle</h1>", {"title": "Bundle"}, name="bundled")
+        os.chdir("views")
+        self.c.bundle()
+        os.chdir("../")
+        self.assertTrue(os.path.isfile("views/__py__/all.bundle"))
+
+        Suit.registry.invalidate()
+        os.remove("views/__py__/subfolder_bundled.py")
+        self.assertNotIn("views.__py__.subfolder_bundled", sys.modules)
+        self.assertEqual("<h1>Bundled</h1>", Suit("views.subfolder.bundled").execute({"title": "Bundled"}))
+        self.assertEqual(1, Suit.preload("views", freeze=False)["modules"])
+
+        # собранный файл пересобирается при компиляции
+        def recompile(template):
+            with open("views/subfolder/bundled.html", "w") as f:
+                f.write(template)
+            os.chdir("views")
+            self.c.compile()
+            os.chdir("../")
+            Suit.registry.invalidate()
+
+        recompile("<h2><var>title</var></h2>")
+        os.remove("views/__py__/subfolder_bundled.py")
+        self.assertEqual("<h2>Rebuilt</h2>", Suit("views.subfolder.bundled").execute({"title": "Rebuilt"}))
+
+        # повреждённый файл игнорируется, шаблоны загружаются из своих модулей
+        recompile("<h3><var>title</var></h3>")
+        with open("views/__py__/all.bundle", "r+b") as f:
+            f.truncate(len(TemplatesRegistry.bundle_header()) + 8)
+        Suit.registry.invalidate()
+        self.assertEqual("<h3>Corrupt</h3>", Suit("views.subfolder.bundled").execute({"title": "Corrupt"}))
+
+        # файл другой версии формата или собранный другой версией python игнорируется
+        os.remove("views/__py__/subfolder_bundled.py")
+        with open("views/__py__/all.bundle", "r+b") as f:
+            f.write(b"SUITBUNDLE0")
+        Suit.registry.invalidate()
+        self.assertRaises(ImportError, Suit, "views.subfolder.bundled")
+
+    def test_execute_threads(self):
+        """ Экземпляр шаблона общий для всех потоков и не хранит данные между выполнениями """
+        import threading
+        import weakref
+
+        class Data(dict):
+            pass
+
+        template = '''<list for="item" in="items"><var>title</var>:<var>item</var>;</list>'''
+        self.simulate(template, "a:1;a:2;", {"title": "a", "items": [1, 2]}, name="threads")
+        Suit.registry.invalidate()
+        self.assertIs(Suit("views.subfolder.threads").template, Suit("views.subfolder.threads").template)
+
+        data = Data(title="t", items=[1])
+        suit_template = Suit("views.subfolder.threads")
+        self.assertEqual("t:1;", suit_template.execute(data))
+        ref = weakref.ref(data)
+        del data
+        self.assertIsNone(ref())
+
+        errors = []
+
+        def worker(n):
+            expected = "".join("%d:%d;" % (n, i) for i in range(n))
+            for _ in range(200):
+                result = suit_template.execute({"title": n, "items": list(range(n))})
+                if result != expected:
+                    errors.append((expected, result))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+    def test_profiler(self):
+        """ Шаблоны, скомпилированные с PythonProfileSyntax, сообщают время и число вызовов своих тегов """
+        from suit.Suit import PythonProfileSyntax, SuitProfiler
+
+        template = '''<h1><var filter="length">title</var></h1>
+<list for="item" in="items">
+    <if condition="<var>item.n</var> > 1"><true><var filter="length">item.name</var></true><false>-</false></if>
+    <breakpoint include="subfolder.profiledInclude">{"v": <var>item.n</var>}</breakpoint>
+</list>'''
+        data = {"title": "abc", "items": [{"n": 1, "name": "a"}, {"n": 2, "name": "bb"}]}
+        with open("views/subfolder/profiled.html", "w+") as f:
+            f.write(template)
+        with open("views/subfolder/profiledInclude.html", "w+") as f:
+            f.write('''[<expression><var>v</var> * 2</expression>]''')
+        os.chdir("views")
+        self.c.compile()
+        os.chdir("../")
+        with open("views/__py__/subfolder_profiled.py") as f:
+            self.assertEqual(-1, f.read().find("SuitProfiler"))
+
+        os.chdir("views")
+        Compiler({"py": PythonProfileSyntax, "js": JavascriptSyntax}).compile()
+        os.chdir("../")
+        Suit.registry.invalidate()
+        SuitProfiler.reset()
+        self.assertEqual("<h1>3</h1>-[2]2[4]", Suit("views.subfolder.profiled").execute(data))
+        self.assertEqual("<h1>3</h1>-[2]2[4]", "".join(Suit("views.subfolder.profiled").execute_iter(data)))
+
+        calls = {site: calls for site, calls, total, own in SuitProfiler.table()}
+        self.assertEqual({
+            "subfolder/profiled.html": 2,
+            "var title|length (subfolder/profiled.html:1:5)": 2,
+            "list items (subfolder/profiled.html:2:1)": 2,
+            "if (subfolder/profiled.html:3:5)": 4,
+            "var items[item].name|length (subfolder/profiled.html:3:49)": 2,
+            "include subfolder.profiledInclude (subfolder/profiled.html:4:5)": 4,
+            "subfolder/profiledInclude.html": 4,
+            "expression (subfolder/profiledInclude.html:1:2)": 4,
+        }, calls)
+        for site, calls, total, own in SuitProfiler.table():
+            self.assertTrue(0 <= own <= total)
+
+        stacks = [line.rsplit(" ", 1)[0] for line in SuitProfiler.collapsed()]
+        self.assertIn(
+            "subfolder/profiled.html;list items (subfolder/profiled.html:2:1);"
+            "include subfolder.profiledInclude (subfolder/profiled.html:4:5);subfolder/profiledInclude.html;"
+            "expression (subfolder/profiledInclude.html:1:2)", stacks
+        )
+        self.assertEqual(len(SuitProfiler.table()) + 1, len(SuitProfiler.report().split("\n")))
+        SuitProfiler.reset()
+        self.assertEqual([], SuitProfiler.collapsed())
+
+    def test_cache(self):
+        """ Фрагмент внутри <cache> выполняется один раз для ключа и берется из кеша, пока не истечет его ttl """
+        import asyncio
+        import time
+        from suit.Suit import FragmentsCache, Cache
+
+        Suit.fragments.clear()
+        template = '''<list for="item" in="items"><cache key="item-<var>item.id</var>" ttl="60">'''\
+                   '''<list for="tag" in="item.tags"><var>tag</var>,</list><var>item.name</var>;</cache></list>'''
+        data = {"items": [
+            {"id": 1, "name": "a", "tags": ["x"]}, {"id": 2, "name": "b", "tags": []}, {"id": 1, "name": "c", "tags": []}
+        ]}
+        self.simulate(template, "x,a;b;x,a;", data, name="cached")
+        self.assertEqual({
+            "fragments": 2, "chars": 6, "hits": 1, "misses": 2, "expirations": 0, "evictions": 0
+        }, dict(Suit.fragments.stats()))
+
+        data = {"items": [{"id": 2, "name": "d", "tags": []}, {"id": 3, "name": "e", "tags": ["y"]}]}
+        self.assertEqual("b;y,e;", Suit("views.subfolder.cached").execute(data))
+        self.assertEqual("b;y,e;", "".join(Suit("views.subfolder.cached").execute_iter(data)))
+        self.assertEqual("b;y,e;", asyncio.run(Suit("views.subfolder.cached").execute_async(data)))
+        Suit.fragments.invalidate("item-2")
+        self.assertEqual("d;y,e;", Suit("views.subfolder.cached").execute(data))
+
+        inc_template = '''[<var>v</var>]'''
+        self.simulate(inc_template, "[0]", {"v": 0}, name="cachedInclude")
+        template = '''<cache key="inc"><breakpoint include="subfolder.cachedInclude">{"v": <var>v</var>}</breakpoint>'''\
+                   '''<flush/></cache>'''
+        self.simulate(template, "[1]", {"v": 1}, name="cachedWithInclude")
+        self.assertEqual("[1]", "".join(Suit("views.subfolder.cachedWithInclude").execute_iter({"v": 2})))
+        Suit.fragments.clear()
+        self.assertEqual("[3]", asyncio.run(Suit("views.subfolder.cachedWithInclude").execute_async({"v": 3})))
+        self.assertEqual("[3]", Suit("views.subfolder.cachedWithInclude").execute({"v": 4}))
+
+        # одинаковые ключи разных тегов и шаблонов не смешиваются
+        Suit.fragments.clear()
+        self.simulate('''<cache key="shared">a<var>v</var></cache>|<cache key="shared">b<var>v</var></cache>''',
+                      "a1|b1", {"v": 1}, name="sharedKeyFirst")
+        self.simulate('''<cache key="shared">c<var>v</var></cache>''', "c1", {"v": 1}, name="sharedKeySecond")
+        self.assertEqual("a1|b1", Suit("views.subfolder.sharedKeyFirst").execute({"v": 2}))
+        self.assertEqual("c1", Suit("views.subfolder.sharedKeySecond").execute({"v": 2}))
+        Suit.fragments.invalidate("shared", template="subfolder.sharedKeySecond")
+        self.assertEqual("a1|b1", Suit("views.subfolder.sharedKeyFirst").execute({"v": 2}))
+        self.assertEqual("c2", Suit("views.subfolder.sharedKeySecond").execute({"v": 2}))
+
+        cache = FragmentsCache(size=2, max_chars=10)
+        cache.set("a", "12345")
+        cache.set("b", "123")
+        self.assertEqual("12345", cache.get("a"))
+        cache.set("c", "1234")
+        self.assertIsNone(cache.get("b"))
+        cache.set("d", "1")
+        self.assertEqual((None, "1234", "1"), (cache.get("a"), cache.get("c"), cache.get("d")))
+        cache.set("e", "x", ttl=0.001)
+        cache.set("f", "x", ttl=0)
+        time.sleep(0.01)
+        self.assertEqual((None, None), (cache.get("e"), cache.get("f")))
+        stats = cache.stats()
+        self.assertEqual((1, 1, 3, 1), (stats["fragments"], stats["chars"], stats["evictions"], stats["expirations"]))
+        self.assertRaises(TemplateParseError, Cache, '<cache ttl="60">x</cache>')
+        self.assertRaises(TemplateParseError, Cache, '<cache key="k" ttl="minute">x</cache>')
+        Suit.fragments.clear()
+
+    def test_execute_async(self):
+        """
+        Значениями данных могут быть корутины: ожидаются только те из них, которые используются шаблоном,
+        причем значения, нужные соседним включениям, ожидаются одновременно
+        """
+        import asyncio
+
+        inc_template = '''[<var>v</var>]'''
+        template = '''
+            <h1><var>title</var></h1>
+            <if condition="<var>show</var>"><true><var>hidden</var></true></if>
+            <list for="item" in="items"><var>item</var></list>
+            <breakpoint include="subfolder.inc_async">{"v": "<var>first</var>"}</breakpoint>
+            <breakpoint include="subfolder.inc_async">{"v": "<var>second</var>"}</breakpoint>
+        '''
+        expected = "<h1>Async</h1>123[1][2]"
+        self.simulate(inc_template, "[1]", {"v": 1}, name="inc_async")
+        self.simulate(template, expected, {"title": "Async", "show": False, "items": [1, 2, 3], "first": 1, "second": 2},
+                      name="async")
+
+        loaded = []
+
+        async def load(name, value, wait=None, notify=None):
+            loaded.append(name)
+            if notify:
+                notify.set()
+            if wait:
+                await asyncio.wait_for(wait.wait(), 1)
+            return value
+
+        async def execute():
+            second_loading = asyncio.Event()
+            return await Suit("views.subfolder.async").execute_async({
+                "title": load("title", "Async"),
+                "show": False,
+                "hidden": load("hidden", "!"),
+                "items": load("items", [1, 2, 3]),
+                "first": load("first", 1, wait=second_loading),
+                "second": load("second", 2, notify=second_loading)
+            })
+
+        self.assertEqual(expected, asyncio.run(execute()))
+        self.assertEqual(["first", "items", "second", "title"], sorted(loaded))
+
+    def test_execute_async_error(self):
+        """ Если выполнение шаблона прервано ошибкой, незавершенные задачи включений отменяются """
+        import asyncio
+
+        self.simulate('''[<var>v</var>]''', "[1]", {"v": 1}, name="asyncErrorInclude")
+        template = '''<breakpoint include="subfolder.asyncErrorInclude">{"v": <var>v</var>}</breakpoint>''' \
+                   '''<breakpoint include="subfolder.asyncErrorInclude">{"v": 2}</breakpoint>''' \
+                   '''<expression>1 % <var>zero</var></expression>'''
+        self.simulate(template, "[1][2]0", {"v": 1, "zero": 1}, name="asyncError")
+        errors = []
+
+        async def execute():
+            loop = asyncio.get_running_loop()
+            loop.set_exception_handler(lambda loop, context: errors.append(context))
+            with self.assertRaises(ZeroDivisionError):
+                await Suit("views.subfolder.asyncError").execute_async({"v": loop.create_future(), "zero": 0})
+            await asyncio.sleep(0.01)
+            return asyncio.all_tasks()
+
+        self.assertEqual(1, len(asyncio.run(execute())))
+        self.assertEqual([], errors)
+
+    def test_var_missing_paths(self):
+        """ Отсутствующая на любом уровне вложенности переменная заменяется значением по умолчанию """
+        template = '''
+            <var d="1">a.b.c</var>|<var d="2">user.name</var>|<var d="3">user.tags.[5]</var>|<var d="4">user.tags.[0].x</var>|
+            <var d="5">empty.key</var>|<var d="<var>user.tags.[1]</var>">user.tags.[1].name</var>|<var>user.tags.[1]</var>
+        '''
+        data = {"user": {"name": None, "tags": ["a", "b"]}, "empty": None}
+        self.simulate(template, "1|2|3|4|5|b|b", data)
+
+        data_template = '''<list for="item" in="items"><var d="-">item.name</var>,<var d="-">item.[0]</var>;</list>'''
+        self.simulate(data_template, "x,-;-,-;-,y;", {"items": [{"name": "x"}, None, ["y"]]})
+
+    def test_filter_literal_data(self):
+        """ Литеральные данные фильтров in, notin и plural_form разбираются при компиляции, а не при каждом вызове """
+        template = '''<var filter="in" in-data='["a","b"]'>x</var>|<var filter="notin" notin-data='["a","b"]'>x</var>|''' \
+                   '''<var filter="plural_form" plural_form-data='["яблоко","яблока","яблок"]'>n</var>'''
+        self.simulate(template, "True|False|21 яблоко", {"x": "b", "n": 21}, name="literalData",
+                      filterForExecuted=self.titleCase)
+        self.simulate(template, "False|True|3 яблока", {"x": "c", "n": 3}, name="literalData2",
+                      filterForExecuted=self.titleCase)
+        self.assertEqual("False|True|5 яблок", Suit("views.subfolder.literalData").execute({"x": ["b"], "n": 5}))
+        with open("views/__py__/subfolder_literalData.py") as f:
+            self.assertIn("_const0 = frozenset({'a', 'b'})", f.read())
+
+    def test_filter_registry(self):
+        """
+        Проекты регистрируют свои фильтры в реестре SuitFilters, результаты чистых фильтров запоминаются
+        на время выполнения шаблона, а нечистые фильтры вызываются каждый раз
+        """
+        from suit.Suit import SuitFilters
+
+        calls = []
+
+        def shout(var):
+            calls.append(var)
+            return "%s!" % var
+
+        SuitFilters.register("shout", shout, pure=True, javascript='({var} + "!")')
+        SuitFilters.register("loud", javascript='({var} + "!")')(lambda var: calls.append(var) or "%s!" % var)
+        try:
+            template = '''<list for="item" in="items"><var filter="shout">item</var><var filter="loud">item</var>;</list>'''
+            self.simulate(template, "a!a!;b!b!;a!a!;", {"items": ["a", "b", "a"]}, name="registeredFilters")
+            del calls[:]
+            Suit("views.subfolder.registeredFilters").execute({"items": ["a", "b", "a", [1]]})
+            self.assertEqual(["a", "a", "b", "b", "a", [1], [1]], calls)
+        finally:
+            del SuitFilters.registry["shout"], SuitFilters.registry["loud"]
+        self.assertIs(SuitFilters.registry["length"], SuitFilters.registry["length"])
+        self.assertIn("length", SuitFilters.registry)
+
+    def test_suit_none_shared(self):
+        """ Экземпляры SuitNone неизменяемы и переиспользуются, сравнение с ними работает как прежде """
+        from suit.Suit import SuitNone
+
+        self.assertIs(SuitNone(), SuitNone())
+        self.assertIs(SuitNone(), SuitNone()["a"]["b"])
+        self.assertIs(SuitNone("-"), SuitNone("-"))
+        self.assertEqual("-", str(SuitNone("-")["a"]))
+        self.assertEqual(["1", "1.0", "True"], [str(SuitNone(value).value) for value in (1, 1.0, True)])
+        self.assertEqual([1], SuitNone([1]).value)
+        self.assertRaises(AttributeError, setattr, SuitNone(), "value", 1)
+        self.assertFalse(SuitNone() == SuitNone())
+        self.assertTrue(SuitNone() != SuitNone())
+        self.assertTrue(SuitNone() < 1 and SuitNone() > -1 and SuitNone() <= 0 and SuitNone() >= 0)
+        self.assertEqual(0, len(SuitNone()))
+        self.assertEqual([], list(SuitNone()))
+        self.simulate('''<if condition="<var>a.b</var> > 0"><true>+</true><false>-</false></if>''', "-", {})
+
+    def test_list_items_bound_once(self):
+        """ Элемент списка извлекается один раз за итерацию, а не по полному пути для каждой переменной """
+
+        class CountingList(list):
+            reads = 0
+
+            def __getitem__(self, index):
+                CountingList.reads += 1
+                return super().__getitem__(index)
+
+        template = '''
+            <list for="item" in="items"><var>i</var>.<var>item.name</var>(<var>item.price</var>)</list>
+            <list for="key, value" in="prices"><var>key</var>=<var>value</var>;</list>
+        '''
+        data = {"items": [{"name": "a", "price": 1}, {"name": "b", "price": 2}], "prices": {"a": 1}}
+        self.simulate(template, "1.a(1)2.b(2)a=1;", data, name="boundItems")
+
+        data["items"] = CountingList(data["items"])
+        self.assertEqual("1.a(1)2.b(2)a=1;", Suit("views.subfolder.boundItems").execute(data))
+        self.assertEqual(0, CountingList.reads)
+
+    def test_json_backends(self):
+        """ Все JSON-бэкенды печатают даты так же, как json_dumps_handler, и одинаково разбирают результат """
+        from suit.Suit import SuitJson, json_backend
+
+        data = {"date": date(2020, 1, 2), "datetime": datetime(2020, 1, 2, 3, 4, 5), "time": time(6, 7, 8),
+                "big": 2 ** 70, "name": "Иван", 1: [None, True, 1.5]}
+        expected = json.loads(json.dumps(data, default=json_dumps_handler))
+        for backend in [SuitJson(), json_backend(fast=True)]:
+            dumped = backend.dumps(data)
+            self.assertEqual(expected, json.loads(dumped), backend.name)
+            self.assertEqual(expected, backend.loads(dumped), backend.name)
+
+        # по умолчанию используется стандартный модуль json, вывод не зависит от установленных пакетов
+        from collections import OrderedDict
+        from suit.Suit import SuitRunTime
+        self.assertEqual("json", json_backend().name)
+        self.assertEqual("json", SuitRunTime.json_backend.name)
+        content = {"name": "Иван\u2028", "items": [1, 2]}
+        self.assertEqual(json.dumps(content, default=json_dumps_handler), SuitRunTime.stringify(content))
+        self.assertIsInstance(SuitJson().loads('{"b": 1, "a": {"c": 2}}')["a"], OrderedDict)
+
+    def test_json_safedumps_fuzz(self):
+        """ json_safedumps на случайных данных дает тот же результат, что и прежняя реализация через цепочку replace """
+        import random
+        from suit.Suit import SuitRunTime, SuitJson, json_backend, json_safedumps
+
+        def reference(content):
+            return SuitRunTime.json_backend.dumps(content) \
+                .replace('\\\\', '__literal_slash__') \
+                .replace('\\n', '') \
+                .replace('\\r', '') \
+                .replace('\\"', '\\\\"') \
+                .replace("'", "\\'") \
+                .replace('__literal_slash__', '\\\\\\\\')
+
+        rnd = random.Random(2013)
+        alphabet = ["\\", '"', "'", "\n", "\r", "\t", "n", "r", "u", "a", "_", "/", " ", "д", " ", "\x00"]
+
+        def text():
+            return "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12)))
+
+        def value(depth=0):
+            kind = rnd.randint(0, 4 if depth < 3 else 2)
+            if kind == 0:
+                return text()
+            elif kind == 1:
+                return rnd.choice([None, True, 1, -2.5, date(2020, 1, 2)])
+            elif kind == 2:
+                return "\\" * rnd.randint(1, 5) + rnd.choice(alphabet)
+            elif kind == 3:
+                return [value(depth + 1) for _ in range(rnd.randint(0, 4))]
+            else:
+                return {text(): value(depth + 1) for _ in range(rnd.randint(0, 4))}
+
+        backend = SuitRunTime.json_backend
+        try:
+            for SuitRunTime.json_backend in [SuitJson(), json_backend(fast=True)]:
+                for _ in range(2000):
+                    content = {text(): value() for _ in range(3)}
+                    self.assertEqual(reference(content), json_safedumps(content))
+        finally:
+            SuitRunTime.json_backend = backend
+
+    def test_compiler_reserved_iteration_variable(self):
+        """
+        Переменные цикла, имена которых совпадают с именами, используемыми в скомпилированном коде,
+        переименовываются компилятором
+        """
+        template = '''<list for="ctx" in="items"><var>i</var>:<var>ctx.name</var>(''' \
+                   '''<list for="_v" in="ctx.subs"><var>_v</var>;</list>)''' \
+                   '''<list for="str, _c" in="ctx.attrs"><var>str</var>=<var>_c</var></list>,</list>'''
+        data = {"items": [{"name": "a", "subs": [1, 2], "attrs": {"x": "y"}}, {"name": "b", "subs": [], "attrs": {}}]}
+        self.simulate(template, "1:a(1;2;)x=y,2:b(),", data, name="reservedTemplate")
+
+        os.chdir("views")
+        Compiler({"py": PythonSyntax, "js": JavascriptSyntax}).compile()
+        os.chdir("../")
+        Suit.registry.invalidate()
+        self.assertEqual("1:a(1;2;)x=y,2:b(),", Suit("views.subfolder.reservedTemplate").execute(data))
+
     def test_build_js(self):
         """
         Компилятор должен уметь собирать все скомпилированные js-шаблоны в единый js-файл,